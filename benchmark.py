@@ -0,0 +1,303 @@
+#
+# STEAM STATS BENCHMARKS
+#
+# Generates synthetic driverless-report csvs and times each stage of the
+# app over them, recording wall time and peak traced memory per stage.
+# Results can be saved as a baseline and later runs compared against it:
+#
+#   python benchmark.py generate report.csv --sessions 1000000 --years 3
+#   python benchmark.py run --sessions 300000 --save baseline.json
+#   python benchmark.py run --sessions 300000 --compare baseline.json
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+import platform
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+
+import steam_stats
+
+
+#
+# Synthetic reports: launches spread over the span with a working hours
+# and weekday bias, users drawn with a long tail of occasional users,
+# versions rolled out over time, log-normal durations plus a share of
+# sessions that run for days and of sessions still running at the end.
+#
+GENERATOR_CHUNK_ROWS = 500000
+SESSION_STATES = ['finished', 'failed', 'stopped']
+CPU_COUNTS = [2, 4, 8, 16, 32]
+GPU_COUNTS = [0, 0, 0, 1, 2, 4]
+
+def generate_report(file_path: str, sessions: int = 100000, years: float = 2, users: int = 50,
+                    versions: int = 12, long_share: float = 0.03, running_share: float = 0.01,
+                    seed: int = 0, start: str = '2021-01-01'):
+    """Writes a synthetic driverless-report csv, chunk by chunk so millions of sessions fit in memory"""
+    rng = np.random.default_rng(seed)
+    start_unix = int(pd.Timestamp(start).timestamp())
+    span_sec = int(years * 365 * steam_stats.SECONDS_PER_DAY)
+    end_unix = start_unix + span_sec
+
+    # A few heavy users and a long tail of occasional ones
+    user_weights = 1 / np.arange(1, users + 1) ** 1.1
+    user_weights /= user_weights.sum()
+    hour_weights = np.array([1, 1, 1, 1, 1, 2, 4, 8, 12, 14, 14, 13, 11, 13, 14, 14, 12, 9, 6, 4, 3, 2, 2, 1], float)
+    hour_weights /= hour_weights.sum()
+
+    with open(file_path, 'w', newline='') as f:
+        for offset in range(0, sessions, GENERATOR_CHUNK_ROWS):
+            n = min(GENERATOR_CHUNK_ROWS, sessions - offset)
+            chunk = synthetic_sessions(rng, n, offset, start_unix, span_sec, end_unix, user_weights, hour_weights,
+                                       versions, long_share, running_share)
+            chunk.to_csv(f, index=False, header=offset == 0)
+
+def synthetic_sessions(rng: np.random.Generator, n: int, offset: int, start_unix: int, span_sec: int, end_unix: int,
+                       user_weights: np.ndarray, hour_weights: np.ndarray, versions: int, long_share: float,
+                       running_share: float):
+    """Returns n synthetic sessions, in no particular order like a real report"""
+    n_days = max(span_sec // steam_stats.SECONDS_PER_DAY, 1)
+    days = rng.integers(0, n_days, n)
+    weekend = (days + pd.Timestamp(start_unix, unit='s').dayofweek) % 7 >= 5
+    days[weekend & (rng.random(n) < 0.6)] -= 2
+    days = np.clip(days, 0, n_days - 1)
+    launch = (start_unix + days * steam_stats.SECONDS_PER_DAY + rng.choice(24, n, p=hour_weights) * 3600
+              + rng.integers(0, 3600, n))
+
+    duration = rng.lognormal(np.log(2 * 3600), 1.0, n)
+    long_running = rng.random(n) < long_share
+    duration[long_running] = rng.uniform(1, 21, long_running.sum()) * steam_stats.SECONDS_PER_DAY
+    duration = duration.astype(np.int64)
+
+    # Sessions still running at report time end with it
+    running = (rng.random(n) < running_share) | (launch + duration > end_unix)
+    duration[running] = np.maximum(end_unix - launch[running], 0)
+    state = np.where(running, 'running', rng.choice(SESSION_STATES, n, p=[0.9, 0.04, 0.06]))
+
+    # Newer versions take over as time goes on
+    version = np.clip((launch - start_unix) / span_sec * versions + rng.normal(0, 1, n), 0, versions - 1).astype(int)
+
+    return pd.DataFrame({
+        'id': np.arange(offset, offset + n) + 1,
+        'username': np.char.add('user', rng.choice(len(user_weights), n, p=user_weights).astype(str)),
+        'version': np.char.add('1.', np.char.add(version.astype(str), '.0')),
+        'session_state': state,
+        'session_launch_date': pd.to_datetime(launch, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        'session_launch_unix': launch,
+        'session_end_unix': launch + duration,
+        'session_duration_sec': duration,
+        'cpu_count': rng.choice(CPU_COUNTS, n),
+        'gpu_count': rng.choice(GPU_COUNTS, n),
+    })
+
+
+#
+# Benchmark suite: each stage is timed best of `repeat` runs, then run
+# once more under tracemalloc for its peak memory. Stages that hit a cache
+# in the app (the analytics store, the result cache) are set up cold each run.
+#
+BENCHMARK_REGRESSION_THRESHOLD = 0.2
+BENCHMARK_NOISE_SEC = 0.005
+
+def measure_stage(run, setup=None, repeat: int = 3):
+    """Returns the best wall time and the peak traced memory of a stage"""
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - started)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(seconds), 'peak_mb': peak / 2 ** 20}
+
+def benchmark_stages(file_path: str, work_dir: str):
+    """Returns the (name, run, setup) stages of the app over a report"""
+    stores = []
+
+    def cold_store():
+        steam_stats.forget_dataset(file_path)
+        if stores:
+            shutil.rmtree(stores.pop(), ignore_errors=True)
+        stores.append(tempfile.mkdtemp(prefix='store-', dir=work_dir))
+        steam_stats.ANALYTICS_STORE_PATH = stores[-1]
+
+    def load():
+        steam_stats.open_dataset(file_path)
+
+    stages = [('load_csv', load, cold_store)]
+
+    def timeline(x_filter):
+        def run():
+            entry = steam_stats.open_dataset(file_path)
+            if entry['sessions'] is not None:
+                steam_stats.filter_rows_by_timeline(entry['sessions'], x_filter)
+            else:
+                steam_stats.dataset_timeline_rows(entry, x_filter)
+        return run
+
+    def results(x_filter):
+        return lambda: steam_stats.usage_results(file_path, x_filter)
+
+    for x_filter in steam_stats.TIMELINE_CHOICES:
+        stages.append(('filter_rows_by_timeline[{0}]'.format(x_filter), timeline(x_filter), None))
+    for x_filter in steam_stats.TIMELINE_CHOICES:
+        stages.append(('usage_results[{0}]'.format(x_filter), results(x_filter), steam_stats.clear_result_cache))
+
+    usage = {}
+
+    def all_results():
+        if 'All' not in usage:
+            usage['All'] = steam_stats.usage_results(file_path, 'All')
+        return usage['All']
+
+    def cold_charts():
+        all_results()
+        steam_stats.clear_result_cache()
+
+    stages.append(('make_ui_processed', lambda: steam_stats.make_ui_processed(all_results(), 'processed'),
+                   all_results))
+    stages.append(('make_ui_summary', lambda: steam_stats.make_ui_summary(all_results(), 'summary'), all_results))
+    stages.append(('render_charts', lambda: steam_stats.make_chart_cards(file_path, 'All', all_results()),
+                   cold_charts))
+
+    def table(sort):
+        def run():
+            view = steam_stats.new_raw_table_view()
+            view['sort'] = sort
+            steam_stats.make_ui_table(file_path, 'table', 'All', view)
+        return run
+
+    stages.append(('make_ui_table', table(None), None))
+    stages.append(('make_ui_table[sorted]', table({'username': False}), None))
+    return stages
+
+def run_benchmarks(file_path: str, work_dir: str, repeat: int = 3, report: dict = None):
+    """Runs every stage over a report and returns the results, ready to be saved as a baseline"""
+    stages = {}
+    for name, run, setup in benchmark_stages(file_path, work_dir):
+        # Ingest is slow on big reports, it is timed on a single run
+        stages[name] = measure_stage(run, setup, 1 if name == 'load_csv' else repeat)
+        print('{0:<40} {1:>9.3f}s {2:>9.1f} MB'.format(name, stages[name]['seconds'], stages[name]['peak_mb']))
+
+    entry = steam_stats.open_dataset(file_path)
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'report': dict(report or {}, file=os.path.basename(file_path), bytes=os.path.getsize(file_path),
+                       rows=entry['meta']['n_rows'], streamed=entry['sessions'] is None),
+        'stages': stages,
+    }
+
+def compare_benchmarks(results: dict, baseline: dict, threshold: float = BENCHMARK_REGRESSION_THRESHOLD):
+    """Prints each stage against the baseline and returns the names of those that regressed"""
+    if results['report'].get('rows') != baseline['report'].get('rows'):
+        print('Baseline was taken on a different report, ratios are only indicative', file=sys.stderr)
+
+    regressed = []
+    print('{0:<40} {1:>10} {2:>10} {3:>7} {4:>10} {5:>7}'.format('stage', 'base s', 'now s', 'ratio', 'now MB', 'ratio'))
+    for name, now in results['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print('{0:<40} {1:>10} {2:>10.3f}'.format(name, '-', now['seconds']))
+            continue
+        time_ratio = now['seconds'] / max(base['seconds'], 1e-9)
+        memory_ratio = now['peak_mb'] / max(base['peak_mb'], 1e-9)
+        slower = time_ratio > 1 + threshold and now['seconds'] - base['seconds'] > BENCHMARK_NOISE_SEC
+        bigger = memory_ratio > 1 + threshold and now['peak_mb'] - base['peak_mb'] > 1
+        if slower or bigger:
+            regressed.append(name)
+        print('{0:<40} {1:>10.3f} {2:>10.3f} {3:>6.2f}x {4:>10.1f} {5:>6.2f}x{6}'.format(
+            name, base['seconds'], now['seconds'], time_ratio, now['peak_mb'], memory_ratio,
+            '  REGRESSED' if slower or bigger else ''))
+    return regressed
+
+def synthetic_report_path(work_dir: str, params: dict):
+    """Returns the path of the synthetic report for the given generator settings, generating it if needed"""
+    name = 'driverless-report-synthetic-' + '-'.join('{0}{1}'.format(k, v) for k, v in sorted(params.items())) + '.csv'
+    file_path = os.path.join(work_dir, name)
+    if not os.path.exists(file_path):
+        print('Generating', file_path)
+        generate_report(file_path + '.tmp', **params)
+        os.replace(file_path + '.tmp', file_path)
+    return file_path
+
+def add_generator_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--sessions', type=int, default=100000, help='number of sessions')
+    parser.add_argument('--years', type=float, default=2, help='span of the report in years')
+    parser.add_argument('--users', type=int, default=50, help='number of distinct users')
+    parser.add_argument('--versions', type=int, default=12, help='number of distinct product versions')
+    parser.add_argument('--long-share', type=float, default=0.03, help='share of sessions running for days')
+    parser.add_argument('--running-share', type=float, default=0.01, help='share of sessions still running')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+def generator_params(args: argparse.Namespace):
+    return {'sessions': args.sessions, 'years': args.years, 'users': args.users, 'versions': args.versions,
+            'long_share': args.long_share, 'running_share': args.running_share, 'seed': args.seed}
+
+def benchmark_main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Synthetic driverless-reports and stage benchmarks of Steam Stats')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='write a synthetic driverless-report csv')
+    generate.add_argument('out', help='csv file to write')
+    add_generator_arguments(generate)
+
+    run = commands.add_parser('run', help='time each stage of the app over a report')
+    run.add_argument('--report', help='report to benchmark, instead of a synthetic one')
+    add_generator_arguments(run)
+    run.add_argument('--work', help='directory for synthetic reports and analytics stores (default: a temp dir)')
+    run.add_argument('-r', '--repeat', type=int, default=3, help='runs per stage, the best one is kept')
+    run.add_argument('--save', help='write the results to this json file, to use as a baseline')
+    run.add_argument('--compare', help='compare the results against this baseline json file')
+    run.add_argument('--threshold', type=float, default=BENCHMARK_REGRESSION_THRESHOLD,
+                     help='relative slowdown or memory growth that counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate_report(args.out, **generator_params(args))
+        return
+
+    work_dir = args.work or tempfile.mkdtemp(prefix='steam-stats-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        if args.report:
+            file_path, params = os.path.abspath(args.report), None
+        else:
+            params = generator_params(args)
+            file_path = synthetic_report_path(work_dir, params)
+        results = run_benchmarks(file_path, work_dir, args.repeat, params)
+    finally:
+        if args.work is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare_benchmarks(results, json.load(f), args.threshold)
+        if regressed:
+            print('{0} stage(s) regressed: {1}'.format(len(regressed), ', '.join(regressed)), file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    benchmark_main()
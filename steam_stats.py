@@ -9,19 +9,41 @@
 #
 
 import os
-import datetime
+import io
 import time
+import json
+import logging
+import contextlib
+import collections
+import datetime
+import hashlib
+import sqlite3
+import gzip
+import zipfile
+import asyncio
+import threading
+import concurrent.futures
+import argparse
+import glob
+import sys
+import shutil
+import uuid
+import importlib.util
 from h2o_wave import main, app, Q, ui, data
 
 import pandas as pd
 import numpy as np
 
-import pandasql as psql
-from pandasql import sqldf
+import sqlalchemy
 
 import altair as alt
 import re
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 @app('/')
 async def serve(q: Q):
@@ -29,6 +51,8 @@ async def serve(q: Q):
     if not q.client.initialized:
             initialize_app_for_new_client(q)
 
+    render = start_diagnostics_render(q)
+
     if q.args.file_upload:
             await handle_uploaded_data(q)
 
@@ -41,6 +65,16 @@ async def serve(q: Q):
     if q.args.show_timeline:
             await set_timeline(q)
 
+    if q.events.head_of_table:
+            await handle_raw_table_event(q)
+
+    if q.args.group_button:
+            await handle_group_by(q)
+
+    if q.args.peak_by_day_stats or q.args.active_button:
+            await handle_active_sessions(q)
+
+    finish_diagnostics_render(q, render)
     await q.page.save()
 
 async def handle_uploaded_data(q: Q):
@@ -48,43 +82,85 @@ async def handle_uploaded_data(q: Q):
     if q.page['back_button']:
             del q.page['back_button']
             del q.page['daily_peak_sessions_users']
+            del q.page['peak_concurrency']
             del q.page['product_usage']
             del q.page['user_usage']
+            del q.page['rolling_users']
+            del q.page['rolling_cpu_hours']
+            del q.page['rolling_gpu_hours']
     
     data_path = q.client.data_path
+    previous_path = q.client.working_file_path
+    q.client.analytics_error = None
+
+    # Appending merges the new report into the current one, rolling up only the days it touches.
+    # A re-export usually has the current report's name, so it is downloaded aside rather than over it
+    q.client.append_upload = bool(q.args.append_upload)
+    appending = q.client.append_upload and q.client.working_file_path
+    if appending:
+        data_path = os.path.join(data_path, 'append-' + uuid.uuid4().hex)
+        os.makedirs(data_path)
 
     # Download new dataset to data directory
-    q.client.working_file_path = await q.site.download(url=q.args.file_upload[0], path=data_path)
+    file_path = await q.site.download(url=q.args.file_upload[0], path=data_path)
+
+    if appending:
+        file_path = await run_analytics(q, 'view', 'Appending report', append_report,
+                                        q.client.working_file_path, file_path)
+        shutil.rmtree(data_path, ignore_errors=True)
+        if file_path is None:
+            return
+
+    q.client.working_file_path = file_path
     q.client.timeline = 'All'
+    q.client.active_sessions = None
+    q.client.state = "render_first_page"
 
-    # Update views to end user
-    render_table_summary_info(q)
-    time.sleep(1)  # show the Upload Success for 1 second before refreshing this view
+    # Update views to end user, the report is parsed (or streamed) once
+    # into the session store on the way
+    if not await render_table_summary_info(q):
+        # A report that could not be read leaves the previous one in place
+        if q.client.analytics_error and q.client.working_file_path == file_path:
+            q.client.working_file_path = previous_path
+            q.client.active_sessions = None
+            if previous_path:
+                await render_table_summary_info(q)
+        return
+    await q.page.save()
+    await q.sleep(1)  # show the Upload Success for 1 second before refreshing this view
     render_upload_view(q)
 
 async def render_first_page(q:Q):
     del q.page['back_button']
     del q.page['daily_peak_sessions_users']
+    del q.page['peak_concurrency']
     del q.page['product_usage']
     del q.page['user_usage']
-    render_table_summary_info(q)
+    del q.page['rolling_users']
+    del q.page['rolling_cpu_hours']
+    del q.page['rolling_gpu_hours']
     q.client.state = "render_first_page"
+    await render_table_summary_info(q)
     
 async def drill_down_charts(q:Q):
     """Deletes tables and summary cards and renders nice charts"""
     del q.page['table']
     del q.page['peak_usage']
     del q.page['summary_view']
+    del q.page['group_by']
     del q.page['drill_button']
     del q.page['timeline']
 
     back_button = [ui.button(name='back_button', label='<< Back', primary=True)]
     q.page['back_button'] = ui.form_card(box='1 8 2 1',items=back_button)
     q.client.state = "render_charts"
-    render_charts(q)
+    await render_charts(q)
 
 async def set_timeline(q:Q):
-    q.client.timeline = q.args.choice_group
+    if q.args.choice_group == CUSTOM_TIMELINE:
+        q.client.timeline = custom_timeline(q.args.start_date, q.args.end_date)
+    else:
+        q.client.timeline = q.args.choice_group
 
     if (q.client.state == "render_charts"):
         await drill_down_charts(q)
@@ -116,170 +192,1610 @@ def initialize_app_for_new_client(q):
 
     q.client.initialized = True
     q.client.timeline = 'All'
+    q.client.analytics_jobs = {}
+    q.client.group_by = new_group_by()
+    q.client.active_sessions = None
+
+
+def render_upload_view(q: Q, job: dict = None):
+    """Sets up the upload-dataset card, with the progress of a running analytics job if any"""
+    items = [
+            ui.separator(label='Upload sessions.csv'),
+            ui.file_upload(name='file_upload', label='Upload Data', multiple=False, file_extensions=REPORT_EXTENSIONS),
+    ]
+    if q.client.working_file_path:
+        items.append(ui.toggle(name='append_upload', label='Append to the current report',
+                               value=bool(q.client.append_upload)))
+    if job is not None:
+        items.append(ui.progress(label=job['caption'], value=job['value']))
+    if q.client.analytics_error:
+        items.append(ui.message_bar(type='error', text=q.client.analytics_error))
 
-
-def render_upload_view(q: Q):
-    """Sets up the upload-dataset card"""
     q.page['upload'] = ui.form_card(
             box='1 2 2 5',
-            items=[
-                    ui.separator(label='Upload sessions.csv'),
-                    ui.file_upload(name='file_upload', label='Upload Data', multiple=False, file_extensions=['csv']),
-            ]
+            items=items
     )
 
 
-def render_table_summary_info(q: Q):
-    """Sets up the view a file as ui.table card"""
+#
+# Analytics jobs: the pandas and SQLite work behind every view runs on a
+# worker thread pool so the Wave event loop keeps serving other clients.
+# While a job runs, its progress is shown in the upload card. Each client
+# runs one job per slot; starting a new one (e.g. picking another timeline
+# mid-computation) cancels the previous one at its next progress report.
+# Threads rather than processes, since workers share the in-memory session
+# store. A job that fails (e.g. on a report that cannot be read) is logged
+# and its error shown in the upload card. Cards a job publishes while it
+# runs are shown at the next progress update, before the job is done.
+#
+ANALYTICS_WORKERS = 4
+PROGRESS_INTERVAL = 0.5
+
+analytics_log = logging.getLogger('steam_stats')
+
+analytics_pool = concurrent.futures.ThreadPoolExecutor(max_workers=ANALYTICS_WORKERS,
+                                                      thread_name_prefix='steam-stats')
+
+class AnalyticsCancelled(Exception):
+    """Raised in a worker when the job it runs for was superseded"""
+
+def new_analytics_job(caption: str):
+    """Returns a job handle shared between the event loop and a worker"""
+    return {'cancelled': threading.Event(), 'caption': caption, 'value': None, 'cards': collections.deque()}
+
+def report_progress(job: dict, caption: str = None, value: float = None):
+    """Records a job's progress, raising AnalyticsCancelled if it was superseded"""
+    if job is None:
+        return
+    if job['cancelled'].is_set():
+        raise AnalyticsCancelled()
+    if caption is not None:
+        job['caption'] = caption
+    job['value'] = value
+
+def publish_card(job: dict, cards: dict, name: str, card):
+    """Adds a card to the cards a job builds, to be shown right away rather than when the job is done"""
+    cards[name] = card
+    if job is not None:
+        job['cards'].append((name, card))
+
+def show_published_cards(q: Q, job: dict):
+    """Puts the cards a job published since the last call on the page"""
+    while job['cards']:
+        name, card = job['cards'].popleft()
+        q.page[name] = card
+
+async def run_analytics(q: Q, slot: str, caption: str, func, *args):
+    """Runs func(*args, job) on the worker pool, returning None if the job got cancelled"""
+    jobs = q.client.analytics_jobs
+    if jobs.get(slot) is not None:
+        jobs[slot]['cancelled'].set()
+    job = new_analytics_job(caption)
+    jobs[slot] = job
+
+    # Only jobs that take a while get a progress bar
+    task = asyncio.ensure_future(q.exec(analytics_pool, run_analytics_job, func, args, job))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=PROGRESS_INTERVAL)
+        if done or job['cancelled'].is_set():
+            break
+        show_published_cards(q, job)
+        render_upload_view(q, job)
+        await q.page.save()
+
+    if jobs.get(slot) is job:
+        jobs[slot] = None
+        render_upload_view(q)
+
+    try:
+        return await task
+    except AnalyticsCancelled:
+        return None
+    except Exception as e:
+        analytics_log.exception('%s failed', caption)
+        q.client.analytics_error = '{0} failed: {1}'.format(caption, e)
+        render_upload_view(q)
+        return None
+    finally:
+        collect_job_diagnostics(q, job)
+
+def run_analytics_job(func, args: tuple, job: dict):
+    """Runs func(*args, job) on a worker, as a diagnostics stage of the job"""
+    diagnostics_local.job = job
+    try:
+        with diagnostics_stage(func.__name__):
+            return func(*args, job)
+    finally:
+        diagnostics_local.job = None
+
+
+#
+# Diagnostics: with STEAM_STATS_DIAGNOSTICS set, every render (one serve
+# call) records the wall time, rows in/out and process memory delta of the
+# analytics jobs it ran and of the stages and store queries within them.
+# Records go to the steam_stats.diagnostics logger as JSON lines, and the
+# last few renders of a client are listed in a Diagnostics card. When
+# unset, stages only pay for a flag check.
+#
+DIAGNOSTICS_ENABLED = os.environ.get('STEAM_STATS_DIAGNOSTICS', '') not in ('', '0')
+DIAGNOSTICS_RENDERS = 10
+DIAGNOSTICS_EVENTS = ['file_upload', 'drill_button', 'back_button', 'show_timeline', 'head_of_table', 'group_button',
+                      'peak_by_day_stats', 'active_button']
+
+diagnostics_log = logging.getLogger('steam_stats.diagnostics')
+diagnostics_local = threading.local()
+
+if DIAGNOSTICS_ENABLED and not diagnostics_log.handlers:
+    diagnostics_log.addHandler(logging.StreamHandler())
+    diagnostics_log.setLevel(logging.INFO)
+
+def process_rss_mb():
+    """Returns the resident memory of the process in MB, None where it cannot be read"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, AttributeError, ValueError):
+        return None
+
+@contextlib.contextmanager
+def diagnostics_stage(name: str, rows_in: int = None):
+    """Records a stage of the running analytics job, yielding its record so rows_out can be set"""
+    if not DIAGNOSTICS_ENABLED:
+        yield {}
+        return
+
+    stage = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+    rss = process_rss_mb()
+    started = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        stage['seconds'] = round(time.perf_counter() - started, 4)
+        stage['rss_delta_mb'] = None if rss is None else round(process_rss_mb() - rss, 1)
+        diagnostics_log.info(json.dumps(stage))
+        job = getattr(diagnostics_local, 'job', None)
+        if job is not None:
+            job.setdefault('stages', []).append(stage)
+
+def start_diagnostics_render(q: Q):
+    """Starts the diagnostics record of a serve call, None when diagnostics are off"""
+    if not DIAGNOSTICS_ENABLED:
+        return None
+
+    event = next((x for x in DIAGNOSTICS_EVENTS if q.args[x] or q.events[x]), 'load')
+    render = {'event': event, 'at': datetime.datetime.now().strftime('%H:%M:%S'), 'stages': [],
+              'rss': process_rss_mb(), 'started': time.perf_counter()}
+    q.client.diagnostics_render = render
+    return render
+
+def collect_job_diagnostics(q: Q, job: dict):
+    """Adds the stages an analytics job recorded to the client's current render"""
+    render = q.client.diagnostics_render
+    if render is not None:
+        render['stages'].extend(job.get('stages', []))
+
+def finish_diagnostics_render(q: Q, render: dict):
+    """Logs a serve call and shows it with the client's previous renders in the Diagnostics card"""
+    if render is None:
+        return
+
+    q.client.diagnostics_render = None
+    rss = process_rss_mb()
+    render['seconds'] = round(time.perf_counter() - render.pop('started'), 4)
+    render['rss_delta_mb'] = None if rss is None else round(rss - render.pop('rss'), 1)
+    diagnostics_log.info(json.dumps({'render': render['event'], 'seconds': render['seconds'],
+                                     'rss_delta_mb': render['rss_delta_mb']}))
+
+    if q.client.diagnostics is None:
+        q.client.diagnostics = collections.deque(maxlen=DIAGNOSTICS_RENDERS)
+    q.client.diagnostics.appendleft(render)
+
+    columns = ['At', 'Event', 'Stage', 'Seconds', 'Rows In', 'Rows Out', 'RSS Delta MB']
+    rows = []
+    for past in q.client.diagnostics:
+        rows.append([past['at'], past['event'], '(render)', past['seconds'], None, None, past['rss_delta_mb']])
+        rows.extend([past['at'], past['event'], x['stage'], x['seconds'], x['rows_in'], x['rows_out'],
+                     x['rss_delta_mb']] for x in past['stages'])
+
+    q.page['diagnostics'] = ui.form_card(box='1 29 11 6', items=[
+        ui.separator(label='Diagnostics (last {0} renders)'.format(DIAGNOSTICS_RENDERS)),
+        ui.text_s('Result cache: {0} hits, {1} misses, {2} evictions, {3:.1f} of {4:.0f} MB'.format(
+            result_cache['hits'], result_cache['misses'], result_cache['evictions'],
+            result_cache['bytes'] / 2 ** 20, RESULT_CACHE_BYTES / 2 ** 20)),
+        ui.text_s('Session store: {0} reports, {1:.1f} of {2:.0f} MB'.format(
+            len(session_store), sum(x['nbytes'] for x in list(session_store.values())) / 2 ** 20,
+            SESSION_STORE_BYTES / 2 ** 20)),
+        ui.table(
+            name='diagnostics_table',
+            columns=[ui.table_column(name=x, label=x, sortable=True) for x in columns],
+            rows=[ui.table_row(name=str(i), cells=['' if x is None else str(x) for x in row])
+                  for i, row in enumerate(rows)],
+            downloadable=True,
+        ),
+    ])
+
+
+#
+# Dashboard: placeholders for the table cards go up right away and each
+# card is filled as soon as its data is ready, cheapest first: the summary
+# KPIs and the peak table (both off the daily rollup), then the raw rows
+# and the group by panel (both over the sessions).
+#
+DASHBOARD_CARDS = {
+        'summary_view': ('3 8 3 -1', 'Summary'),
+        'peak_usage': ('6 8 6 -1', 'Peak Usage by Day'),
+        'table': ('3 2 9 6', 'Raw Dataset'),
+        'group_by': ('1 16 11 6', 'Group By'),
+}
+
+def make_placeholder_card(name: str):
+    """Creates a dashboard card that is still being computed"""
+    box, label = DASHBOARD_CARDS[name]
+    return ui.form_card(box=box, items=[ui.separator(label=label), ui.progress(label='Loading')])
+
+async def render_table_summary_info(q: Q):
+    """Sets up the view a file as ui.table card, returning False if it was superseded"""
 
     if (q.page['back_button']):
             del q.page['back_button']
             del q.page['daily_peak_sessions_users']
+            del q.page['peak_concurrency']
             del q.page['product_usage']
             del q.page['user_usage']
+            del q.page['rolling_users']
+            del q.page['rolling_cpu_hours']
+            del q.page['rolling_gpu_hours']
 
-    # Raw data view
-    labelx = "Raw Dataset. Viewing Date Range : "+q.client.timeline
-    items = [ui.separator(label=labelx)]
-    items.append(ui.text_xl(os.path.basename(q.client.working_file_path)))
-    items.append(make_ui_table(file_path=q.client.working_file_path,n_rows=10000, name='head_of_table', timeline=q.client.timeline))
-    q.page['table'] = ui.form_card(box='3 2 9 6', items=items)
+    for name in DASHBOARD_CARDS:
+        q.page[name] = make_placeholder_card(name)
+    await q.page.save()
 
-    # Peak Usage view
-    peak_usage = [ui.separator(label='Peak Usage by Day')]
-    peak_usage.append(make_ui_processed(file_path=q.client.working_file_path,name='peak_by_day_stats', timeline=q.client.timeline))
-    q.page['peak_usage'] = ui.form_card(box='6 8 6 -1',items=peak_usage)
+    view = new_raw_table_view()
+    out = await run_analytics(q, 'view', 'Crunching usage', make_dashboard_cards, q.client.working_file_path,
+                              q.client.timeline, view, q.client.usage_results, q.client.group_by,
+                              q.client.active_sessions)
+    if out is None:
+        # Placeholders of a failed render would spin forever
+        if q.client.analytics_error:
+            for name in DASHBOARD_CARDS:
+                del q.page[name]
+        return False
+
+    cards, q.client.usage_results = out
+    q.client.raw_table_view = view
+    for name, card in cards.items():
+        q.page[name] = card
+    return True
+
+def make_dashboard_cards(file_path: str, timeline: str, view: dict, results: dict, group_by: dict,
+                         active: dict = None, job: dict = None):
+    """Builds the dashboard cards of a report over a timeline, along with its usage results"""
+
+    report_progress(job, 'Loading report')
+    open_dataset(file_path, job)
+
+    if not usage_results_match(results, file_path, timeline):
+        report_progress(job, 'Rolling up usage by day')
+        results = usage_results(file_path, timeline, job)
+
+    cards = {}
 
     # Summary view
-    summary = [ui.separator(label='Summary')]
-    summary.append(make_ui_summary(file_path=q.client.working_file_path,name='summary', timeline=q.client.timeline))
-    q.page['summary_view'] = ui.form_card(box='3 8 3 -1',items=summary)
+    report_progress(job, 'Building tables')
+    summary = [ui.separator(label=DASHBOARD_CARDS['summary_view'][1])]
+    summary.append(cached_result((results['hash'], timeline, 'summary_table'),
+                                 lambda: make_ui_summary(results, name='summary')))
+    publish_card(job, cards, 'summary_view', ui.form_card(box=DASHBOARD_CARDS['summary_view'][0], items=summary))
+
+    # Peak Usage view
+    peak_usage = [ui.separator(label=DASHBOARD_CARDS['peak_usage'][1])]
+    with diagnostics_stage('build peak usage table', rows_in=len(results['peak_usage'])):
+        peak_usage.append(cached_result((results['hash'], timeline, 'peak_usage_table'),
+                                        lambda: make_ui_processed(results, name='peak_by_day_stats')))
+    publish_card(job, cards, 'peak_usage', ui.form_card(box=DASHBOARD_CARDS['peak_usage'][0], items=peak_usage))
 
     # Setup the 'Drill Down' button
     drill_button = [ui.button(name='drill_button', label='Drill Down  >>', primary=True)]
-    q.page['drill_button'] = ui.form_card(box='1 8 2 1',items=drill_button)
+    cards['drill_button'] = ui.form_card(box='1 8 2 1',items=drill_button)
 
     # Setup the Timeline Choices
 
-    clabel = 'Date Range -> '+q.client.timeline
-    q.page['timeline'] = ui.form_card(box = '1 9 2 5', items=[
-        ui.choice_group(name='choice_group',label=clabel,value=q.client.timeline,
+    clabel = 'Date Range -> '+timeline
+    first_date, last_date = session_date_span(file_path)
+    if timeline_choice(timeline) == CUSTOM_TIMELINE:
+        start_date, end_date = timeline.split(' to ')
+    else:
+        start_date, end_date = first_date, last_date
+    publish_card(job, cards, 'timeline', ui.form_card(box = '1 9 2 7', items=[
+        ui.choice_group(name='choice_group',label=clabel,value=timeline_choice(timeline),
                         required=True,
-                        choices=[
-                            ui.choice('All','All'),
-                            ui.choice('First 30 days','First 30 days'),
-                            ui.choice('Recent 30 days','Recent 30 days'),
-                            ui.choice('Recent 60 days','Recent 60 days'),
-                            ui.choice('Recent month','Recent month'),
-                            ui.choice('Prev month','Prev month'),
-                            ui.choice('Recent year','Recent year'),
-                            ui.choice('Prev year','Prev year')
-                        ]
+                        choices=[ui.choice(x, x) for x in TIMELINE_CHOICES + [CUSTOM_TIMELINE]]
                         ),
+        ui.date_picker(name='start_date', label='From', value=start_date, min=first_date, max=last_date),
+        ui.date_picker(name='end_date', label='To', value=end_date, min=first_date, max=last_date),
         ui.button(name='show_timeline',label='Set Date Range',primary=True),
-    ])
+    ]))
+
+    # Raw data view
+    report_progress(job, 'Loading raw rows')
+    labelx = DASHBOARD_CARDS['table'][1]+". Viewing Date Range : "+timeline
+    items = [ui.separator(label=labelx)]
+    items.append(ui.text_xl(os.path.basename(file_path)))
+    items.append(make_ui_table(file_path=file_path, name='head_of_table', timeline=timeline, view=view))
+    publish_card(job, cards, 'table', ui.form_card(box=DASHBOARD_CARDS['table'][0], items=items))
 
+    # Group by view, aggregated over the whole timeline
+    report_progress(job, 'Grouping sessions')
+    publish_card(job, cards, 'group_by', make_group_by_card(file_path, timeline, group_by, job))
 
-def make_ui_table(file_path: str, n_rows: int, name: str, timeline: str):
-    """Creates a ui.table object from a csv file"""
+    # Sessions active on the day (or hour) last picked
+    cards['active_sessions'] = make_active_sessions_card(file_path, active, job)
 
-    df = pd.read_csv(file_path)
-    df = filter_rows_by_timeline(df, timeline)
+    return cards, results
 
-    n_rows = min(n_rows, df.shape[0])
-    
+
+#
+# Session store: every uploaded report is parsed once, with dates and
+# dtypes fixed, and the typed DataFrame is shared by all the views.
+# Entries are keyed by file path and invalidated by the content hash.
+# Reports above STREAMING_INGEST_BYTES are streamed into the analytics
+# store in chunks instead and never held in memory as a whole. Least
+# recently used entries are evicted past SESSION_STORE_BYTES, together
+# with the engine and lock of their report.
+#
+SESSION_STORE_BYTES = int(float(os.environ.get('STEAM_STATS_SESSION_STORE_MB', 1024)) * 2 ** 20)
+
+session_store = collections.OrderedDict()
+session_store_lock = threading.Lock()
+dataset_locks = {}
+
+#
+# Report schema: how the columns of a driverless-report are held in
+# memory. Repeated strings are categoricals, the launch date is parsed once
+# into datetime64, counts and durations take the narrowest int that fits
+# (they stay float when they have gaps) and epoch times stay 64-bit.
+#
+SESSION_CATEGORY_COLUMNS = ['username', 'version', 'session_state']
+SESSION_DATE_COLUMNS = ['session_launch_date']
+SESSION_NUMERIC_COLUMNS = ['session_launch_unix', 'session_end_unix', 'session_duration_sec',
+                           'cpu_count', 'gpu_count']
+SESSION_WIDE_COLUMNS = ['session_launch_unix', 'session_end_unix']
+SESSION_CSV_DTYPES = {col: 'category' for col in SESSION_CATEGORY_COLUMNS}
+
+# Columns the daily rollup reads, the others are left in the store
+ROLLUP_COLUMNS = SESSION_CATEGORY_COLUMNS + SESSION_NUMERIC_COLUMNS
+
+STREAMING_INGEST_BYTES = 256 * 1024 * 1024
+INGEST_CHUNK_ROWS = 200000
+
+#
+# Report files: a report can be uploaded as a csv or compressed, as a
+# .csv.gz, a .zip holding the csv or a .zst, and is decompressed as a
+# stream while it is parsed or ingested, never written out uncompressed.
+# Merged reports are written with the compression of the appended one.
+# Reading or writing .zst reports needs the optional zstandard package.
+#
+REPORT_EXTENSIONS = ['csv', 'gz', 'zip', 'zst']
+REPORT_COMPRESSIONS = {'.gz': 'gzip', '.zip': 'zip', '.zst': 'zstd'}
+COMPRESSED_SIZE_RATIO = 10
+
+def report_compression(file_path: str):
+    """Returns how a report file is compressed, None for a plain csv"""
+    return REPORT_COMPRESSIONS.get(os.path.splitext(file_path)[1].lower())
+
+def report_csv_name(file_path: str):
+    """Returns the name of the csv a report file holds"""
+    root, ext = os.path.splitext(os.path.basename(file_path))
+    if report_compression(file_path) is None:
+        return root + ext
+    return root if root.lower().endswith('.csv') else root + '.csv'
+
+def report_zip_member(archive: zipfile.ZipFile):
+    """Returns the csv held by a zipped report"""
+    members = [x for x in archive.infolist() if not x.is_dir()]
+    csvs = [x for x in members if x.filename.lower().endswith('.csv')]
+    if not (csvs or members):
+        raise ValueError('{0} holds no report'.format(archive.filename))
+    return (csvs or members)[0]
+
+def report_size(file_path: str):
+    """Returns the size of the csv a report file holds, estimated where the format does not record it"""
+    compression = report_compression(file_path)
+    if compression == 'zip':
+        with zipfile.ZipFile(file_path) as archive:
+            return report_zip_member(archive).file_size
+    size = os.path.getsize(file_path)
+    return size if compression is None else size * COMPRESSED_SIZE_RATIO
+
+@contextlib.contextmanager
+def open_report(file_path: str):
+    """Opens a report for reading, yielding its file (whose position tells the progress) and its csv stream"""
+    compression = report_compression(file_path)
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('Reading .zst reports needs the zstandard package')
+
+    with open(file_path, 'rb') as f:
+        if compression is None:
+            yield f, f
+        elif compression == 'gzip':
+            with gzip.GzipFile(fileobj=f) as stream:
+                yield f, stream
+        elif compression == 'zip':
+            with zipfile.ZipFile(f) as archive, archive.open(report_zip_member(archive)) as stream:
+                yield f, stream
+        else:
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                yield f, stream
+
+@contextlib.contextmanager
+def create_report(file_path: str, compression: str = None, csv_name: str = None):
+    """Creates a report file, yielding a text stream its csv is written to, compressed as given"""
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('Writing .zst reports needs the zstandard package')
+
+    # No timestamps in the headers, so the same sessions always hash the same
+    csv_name = csv_name or 'report.csv'
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(open(file_path, 'wb'))
+        if compression is None:
+            stream = f
+        elif compression == 'gzip':
+            stream = stack.enter_context(gzip.GzipFile(filename=csv_name, fileobj=f, mode='wb', mtime=0))
+        elif compression == 'zip':
+            member = zipfile.ZipInfo(csv_name, date_time=(1980, 1, 1, 0, 0, 0))
+            member.compress_type = zipfile.ZIP_DEFLATED
+            archive = stack.enter_context(zipfile.ZipFile(f, 'w'))
+            stream = stack.enter_context(archive.open(member, 'w', force_zip64=True))
+        else:
+            stream = stack.enter_context(zstandard.ZstdCompressor().stream_writer(f, closefd=False))
+
+        # Closing the text layer is left to the stack, in order
+        text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+        try:
+            yield text
+        finally:
+            text.flush()
+            text.detach()
+
+def file_content_hash(file_path: str):
+    """Returns the sha256 hex digest of a file, read in blocks"""
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def fix_session_dtypes(sessions: pd.DataFrame):
+    """Applies the report schema: categoricals, parsed dates and narrow numeric columns"""
+    for col in SESSION_CATEGORY_COLUMNS:
+        if col in sessions.columns and not isinstance(sessions[col].dtype, pd.CategoricalDtype):
+            sessions[col] = sessions[col].astype('category')
+
+    for col in SESSION_DATE_COLUMNS:
+        if col in sessions.columns:
+            sessions[col] = pd.to_datetime(sessions[col], utc=True, errors='coerce').dt.tz_localize(None)
+
+    for col in SESSION_NUMERIC_COLUMNS:
+        if col in sessions.columns:
+            sessions[col] = pd.to_numeric(sessions[col], errors='coerce')
+
+    for col in sessions.columns:
+        if col not in SESSION_WIDE_COLUMNS and pd.api.types.is_integer_dtype(sessions[col]):
+            sessions[col] = pd.to_numeric(sessions[col], downcast='integer')
+
+    return sessions
+
+def read_sessions_csv(file_path: str):
+    """Parses a driverless-report csv into a typed DataFrame"""
+    with diagnostics_stage('parse csv') as stage, open_report(file_path) as (_, stream):
+        sessions = fix_session_dtypes(pd.read_csv(stream, dtype=SESSION_CSV_DTYPES))
+
+        # Keep sessions ordered by launch so timelines are binary searched slices
+        sessions = sessions.sort_values('session_launch_date', kind='stable', na_position='last', ignore_index=True)
+        stage['rows_out'] = len(sessions)
+
+    return sessions
+
+def open_dataset(file_path: str, job: dict = None, derive_rollup=None):
+    """Returns the session store entry of a report, ingesting the file only if its content changed.
+    A new entry gets its daily rollup from derive_rollup(entry, job) when given, instead of a full pass"""
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    entry = stored_dataset(file_path)
+    if entry is not None and entry['signature'] == signature:
+        return entry
+
+    # Only one worker ingests a given report, the others wait for its entry
+    with dataset_lock(file_path):
+        entry = session_store.get(file_path)
+        if entry is not None and entry['signature'] == signature:
+            return entry
+        return open_dataset_locked(file_path, stat, entry, job, derive_rollup)
+
+def dataset_lock(file_path: str):
+    """Returns the lock guarding the ingest of a report"""
+    with session_store_lock:
+        return dataset_locks.setdefault(file_path, threading.Lock())
+
+def open_dataset_locked(file_path: str, stat: os.stat_result, entry: dict, job: dict, derive_rollup=None):
+    """Re-validates or (re-)ingests a report whose file changed, holding its lock"""
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    # File was touched or replaced, only re-parse it if the content differs
+    content_hash = file_content_hash(file_path)
+    if entry is not None and entry['hash'] == content_hash:
+        entry['signature'] = signature
+        return entry
+
+    # A streamed report seen before (even by an earlier run of the app) is
+    # not ingested again. Parsing the csv is faster than reading a store
+    # back, so other reports are always parsed. Their store is only written
+    # when first queried, after the rollup and its cards
+    db_path = analytics_db_path(content_hash)
+    streamed = report_size(file_path) > STREAMING_INGEST_BYTES
+    sessions = None
+    totals = None
+
+    if streamed:
+        if not os.path.exists(db_path):
+            totals = new_usage_totals() if derive_rollup is None else None
+            ingest_csv_in_chunks(file_path, db_path, totals, job)
+        meta = read_store_meta(db_path)
+    else:
+        report_progress(job, 'Parsing report')
+        sessions = read_sessions_csv(file_path)
+        meta = sessions_meta(sessions)
+
+    entry = {'hash': content_hash, 'signature': signature, 'sessions': sessions,
+             'db_path': db_path, 'meta': meta, 'lock': threading.Lock()}
+
+    # Materialize the daily rollup once, every timeline is a slice of it
+    if derive_rollup is not None:
+        entry['rollup'] = derive_rollup(entry, job)
+    else:
+        entry['rollup'] = build_daily_rollup(totals or report_usage_totals(entry, job))
+
+    store_dataset(file_path, entry)
+    return entry
+
+def stored_dataset(file_path: str):
+    """Returns the session store entry of a report if any, marking it as recently used"""
+    with session_store_lock:
+        entry = session_store.get(file_path)
+        if entry is not None:
+            session_store.move_to_end(file_path)
+    return entry
+
+def store_dataset(file_path: str, entry: dict):
+    """Adds (or replaces) the entry of a report, evicting least recently used entries past SESSION_STORE_BYTES"""
+    entry['nbytes'] = result_nbytes({x: entry.get(x) for x in ('sessions', 'rollup', 'intervals')})
+    with session_store_lock:
+        replaced = session_store.pop(file_path, None)
+        session_store[file_path] = entry
+        evicted = [] if replaced is None else [(None, replaced)]
+        while sum(x['nbytes'] for x in session_store.values()) > SESSION_STORE_BYTES and len(session_store) > 1:
+            evicted.append(session_store.popitem(last=False))
+        engines = release_datasets(evicted)
+
+    # Pooled connections are closed outside the lock
+    for engine in engines:
+        engine.dispose()
+
+def forget_dataset(file_path: str):
+    """Drops the entry of a report from the session store, with its engine and lock"""
+    with session_store_lock:
+        entry = session_store.pop(file_path, None)
+        engines = release_datasets([] if entry is None else [(file_path, entry)])
+    for engine in engines:
+        engine.dispose()
+
+def release_datasets(evicted: list):
+    """Releases the locks and engines of (file path, entry) pairs no longer stored, holding session_store_lock.
+    Returns the engines to dispose"""
+    in_use = {x['db_path'] for x in session_store.values()}
+    engines = []
+    for file_path, entry in evicted:
+        if file_path is not None and file_path not in session_store:
+            dataset_locks.pop(file_path, None)
+        if entry['db_path'] not in in_use and entry['db_path'] in analytics_engines:
+            engines.append(analytics_engines.pop(entry['db_path']))
+    return engines
+
+def session_chunks(entry: dict, lo: int = 0, hi: int = None, columns: list = None):
+    """Yields the sessions at positions [lo, hi) of a store entry, chunk by chunk for streamed reports.
+    Streamed chunks only read the given columns"""
+    hi = entry['meta']['n_rows'] if hi is None else hi
+    if entry['sessions'] is not None:
+        yield entry['sessions'].iloc[lo:hi]
+        return
+
+    columns = [col for col in columns or entry['meta']['columns'] if col in entry['meta']['columns']]
+    qq = "select {0} from sessions where rowid > :lo and rowid <= :hi order by rowid".format(
+        ', '.join('"{0}"'.format(col) for col in columns))
+    for chunk in pd.read_sql_query(sqlalchemy.text(qq), analytics_engine(entry['db_path']),
+                                   params={'lo': lo, 'hi': hi}, chunksize=INGEST_CHUNK_ROWS):
+        yield fix_session_dtypes(chunk)
+
+def report_usage_totals(entry: dict, job: dict = None, row_ranges: list = None):
+    """Folds the sessions of a store entry (all of them, or those in the [lo, hi) row ranges) into usage totals"""
+    row_ranges = row_ranges or [(0, entry['meta']['n_rows'])]
+    n_rows = max(sum(hi - lo for lo, hi in row_ranges), 1)
+
+    totals = new_usage_totals()
+    with diagnostics_stage('roll up days', rows_in=n_rows):
+        for lo, hi in row_ranges:
+            for chunk in session_chunks(entry, lo, hi, ROLLUP_COLUMNS):
+                report_progress(job, 'Rolling up days', totals['n_rows'] / n_rows)
+                update_usage_totals(totals, chunk)
+    return totals
+
+#
+# Usage results: the summary and daily rollup of a report over a timeline,
+# handed from stage to stage in memory. Each client keeps its own, so
+# tabs with different reports or timelines never see each other's.
+#
+def usage_results(file_path: str, timeline: str, job: dict = None):
+    """Slices the daily rollup of a report down to a timeline, shared with the other clients through the result cache"""
+    entry = open_dataset(file_path, job)
+    return cached_result((entry['hash'], timeline, 'usage_results'),
+                         lambda: slice_usage_results(file_path, entry, timeline))
+
+def slice_usage_results(file_path: str, entry: dict, timeline: str):
+    """Slices the daily rollup of a session store entry down to a timeline"""
+    rollup = entry['rollup']
+    lo, hi = dataset_timeline_rows(entry, timeline)
+    a, b = rollup_window(rollup, entry['meta'], timeline)
+    with diagnostics_stage('slice rollup', rows_in=hi - lo) as stage:
+        results = {
+            'file_path': file_path,
+            'hash': entry['hash'],
+            'timeline': timeline,
+            'summary': rollup_summary(rollup, a, b, hi - lo),
+            'peak_usage': rollup_peak_usage(rollup, a, b),
+            'concurrency': rollup_concurrency(rollup, a, b),
+        }
+        stage['rows_out'] = len(results['peak_usage'])
+    return results
+
+def rolling_usage(file_path: str, timeline: str):
+    """Returns the rolling usage of a report over a timeline, shared with the other clients through the result cache"""
+    entry = open_dataset(file_path)
+
+    def compute():
+        a, b = rollup_window(entry['rollup'], entry['meta'], timeline)
+        with diagnostics_stage('rolling usage', rows_in=b - a) as stage:
+            rolling = rollup_rolling_usage(entry['rollup'], a, b)
+            stage['rows_out'] = len(rolling)
+        return rolling
+
+    return cached_result((entry['hash'], timeline, 'rolling_usage'), compute)
+
+def usage_results_match(results: dict, file_path: str, timeline: str):
+    """Tells whether a client's usage results are still those of its report and timeline"""
+    return (results is not None and results['file_path'] == file_path and results['timeline'] == timeline
+            and results['hash'] == open_dataset(file_path)['hash'])
+
+#
+# Result cache: what the views compute from a report (usage results,
+# tables, chart specs and query results) is shared by every client of
+# the app, keyed by (content hash, timeline, view), so a second viewer of
+# a report renders from memory. Least recently used results are evicted
+# past RESULT_CACHE_BYTES. Cached results are never mutated.
+#
+RESULT_CACHE_BYTES = int(float(os.environ.get('STEAM_STATS_RESULT_CACHE_MB', 256)) * 2 ** 20)
+
+result_cache = {'entries': collections.OrderedDict(), 'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+result_cache_lock = threading.Lock()
+
+def cached_result(key: tuple, compute):
+    """Returns the cached result of key, computing and caching it with compute() on a miss"""
+    with result_cache_lock:
+        entries = result_cache['entries']
+        if key in entries:
+            entries.move_to_end(key)
+            result_cache['hits'] += 1
+            return entries[key][0]
+        result_cache['misses'] += 1
+
+    # Computed outside the lock, a result racing in from another client is simply replaced
+    value = compute()
+    size = result_nbytes(value)
+    with result_cache_lock:
+        entries = result_cache['entries']
+        if key in entries:
+            result_cache['bytes'] -= entries.pop(key)[1]
+        entries[key] = (value, size)
+        result_cache['bytes'] += size
+        while result_cache['bytes'] > RESULT_CACHE_BYTES and len(entries) > 1:
+            _, (_, evicted) = entries.popitem(last=False)
+            result_cache['bytes'] -= evicted
+            result_cache['evictions'] += 1
+    return value
+
+def result_nbytes(value):
+    """Estimates the memory held by a result"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(result_nbytes(x) for x in value.values()) + 64 * len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(result_nbytes(x) for x in value) + 8 * len(value)
+    if type(value).__module__.startswith('h2o_wave'):
+        # Wave components, sized by their serialized form
+        return len(json.dumps(value.dump(), default=str))
+    return sys.getsizeof(value)
+
+def clear_result_cache():
+    """Drops every cached result, keeping the counters"""
+    with result_cache_lock:
+        result_cache['entries'].clear()
+        result_cache['bytes'] = 0
+
+#
+# Analytics store: each report is ingested once into an on-disk SQLite
+# database named after its content hash, in launch-date order so that a
+# timeline slice of the session store is a rowid range of the table.
+# Queries go through a pooled SQLAlchemy engine per database. An
+# in-memory report is written to its store by the first query that needs
+# it, the drill-down charts, never ahead of the dashboard.
+#
+ANALYTICS_STORE_PATH = './data'
+ANALYTICS_STORE_VERSION = 2
+ANALYTICS_INDEXED_COLUMNS = ['session_launch_date', 'session_launch_unix', 'session_end_unix',
+                             'username', 'version', 'session_state']
+
+analytics_engines = {}
+
+def analytics_db_path(content_hash: str):
+    """Returns the path of the analytics store of a report"""
+    return os.path.join(ANALYTICS_STORE_PATH,
+                        'sessions-v{0}-{1}.sqlite'.format(ANALYTICS_STORE_VERSION, content_hash))
+
+def new_store_path(db_path: str):
+    """Returns a clean temporary path to build a store in, so a half written store is never picked up"""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    # per writer, since batch workers may build the same report's store at once
+    tmp_path = '{}.{}-{}.tmp'.format(db_path, os.getpid(), threading.get_ident())
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return tmp_path
+
+def finish_store(conn: sqlite3.Connection):
+    """Indexes the sessions table and records its launch date span in the meta table"""
+    columns = [x[1] for x in conn.execute('pragma table_info(sessions)')]
+    for col in ANALYTICS_INDEXED_COLUMNS:
+        if col in columns:
+            conn.execute('create index idx_sessions_{0} on sessions ({0})'.format(col))
+
+    n_rows, n_valid, first, latest = conn.execute("""
+            select count(*), count(session_launch_date), min(session_launch_date), max(session_launch_date)
+            from sessions
+        """).fetchone()
+    conn.execute('create table meta (key text primary key, value text)')
+    conn.executemany('insert into meta values (?, ?)',
+                     [('n_rows', n_rows), ('n_valid', n_valid), ('first', first), ('latest', latest)])
+
+def ingest_sessions(sessions: pd.DataFrame, db_path: str):
+    """Writes sorted sessions and their indexes to a new analytics store"""
+    tmp_path = new_store_path(db_path)
+
+    with diagnostics_stage('write store', rows_in=len(sessions)), sqlite3.connect(tmp_path) as conn:
+        sessions.to_sql('sessions', conn, index=False, chunksize=10000)
+        finish_store(conn)
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+
+def ingest_csv_in_chunks(file_path: str, db_path: str, totals: dict = None, job: dict = None):
+    """Streams a report into a new analytics store, folding it into usage totals on the way if given"""
+    tmp_path = new_store_path(db_path)
+    file_size = max(os.path.getsize(file_path), 1)
+
+    with diagnostics_stage('stream csv to store') as stage, sqlite3.connect(tmp_path) as conn, \
+            open_report(file_path) as (f, stream):
+        stage['rows_in'] = 0
+        for chunk in pd.read_csv(stream, chunksize=INGEST_CHUNK_ROWS, dtype=SESSION_CSV_DTYPES):
+            report_progress(job, 'Ingesting report', min(f.tell() / file_size, 1.0))
+            stage['rows_in'] += len(chunk)
+            chunk = fix_session_dtypes(chunk)
+            if totals is not None:
+                update_usage_totals(totals, chunk)
+            chunk.to_sql('raw_sessions', conn, index=False, if_exists='append', chunksize=10000)
+
+        # Let SQLite sort on disk so rowids follow the launch dates
+        report_progress(job, 'Indexing report')
+        conn.execute("""
+                create table sessions as
+                select * from raw_sessions
+                order by session_launch_date is null, session_launch_date
+            """)
+        conn.execute('drop table raw_sessions')
+        finish_store(conn)
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+
+def read_store_meta(db_path: str):
+    """Reads the row counts and launch date span of an analytics store"""
+    engine = analytics_engine(db_path)
+    meta = dict(pd.read_sql_query('select key, value from meta', engine).values)
+    return {
+        'columns': pd.read_sql_query('select * from sessions limit 0', engine).columns.tolist(),
+        'n_rows': int(meta['n_rows']),
+        'n_valid': int(meta['n_valid']),
+        'first': pd.Timestamp(meta['first']) if meta['first'] is not None else None,
+        'latest': pd.Timestamp(meta['latest']) if meta['latest'] is not None else None,
+    }
+
+def sessions_meta(sessions: pd.DataFrame):
+    """Returns the row counts and launch date span of launch-date sorted sessions, as read_store_meta does"""
+    launch, n_valid = launch_date_index(sessions)
+    return {
+        'columns': sessions.columns.tolist(),
+        'n_rows': len(sessions),
+        'n_valid': n_valid,
+        'first': pd.Timestamp(launch[0]) if n_valid else None,
+        'latest': pd.Timestamp(launch[n_valid - 1]) if n_valid else None,
+    }
+
+def store_launch_position(db_path: str, ts: pd.Timestamp, n_valid: int):
+    """Returns the number of sessions launched before ts, found through the launch date index"""
+    qq = """
+            select rowid from sessions
+            where session_launch_date >= :ts
+            order by session_launch_date
+            limit 1
+        """
+    with analytics_engine(db_path).connect() as conn:
+        row = conn.execute(sqlalchemy.text(qq), {'ts': ts.strftime('%Y-%m-%d %H:%M:%S')}).fetchone()
+    return n_valid if row is None else row[0] - 1
+
+def analytics_engine(db_path: str):
+    """Returns the pooled engine of an analytics store"""
+    with session_store_lock:
+        engine = analytics_engines.get(db_path)
+        if engine is None:
+            engine = sqlalchemy.create_engine('sqlite:///' + db_path)
+            analytics_engines[db_path] = engine
+    return engine
+
+def dataset_store(entry: dict):
+    """Returns the analytics store of a session store entry, writing it first for an in-memory report"""
+    if entry['sessions'] is not None and not os.path.exists(entry['db_path']):
+        with entry['lock']:
+            if not os.path.exists(entry['db_path']):
+                ingest_sessions(entry['sessions'], entry['db_path'])
+    return entry['db_path']
+
+def query_sessions(file_path: str, timeline: str, qq: str):
+    """Runs a query over the sessions table of a report's analytics store, narrowed to the timeline"""
+    entry = open_dataset(file_path)
+    lo, hi = dataset_timeline_rows(entry, timeline)
+    db_path = dataset_store(entry)
+
+    # Shadow the table with the timeline's rowid range so queries read unchanged
+    qq = "with sessions as (select * from main.sessions where rowid > :lo and rowid <= :hi) " + qq
+    with diagnostics_stage('query sessions', rows_in=hi - lo) as stage:
+        df = pd.read_sql_query(sqlalchemy.text(qq), analytics_engine(db_path), params={'lo': lo, 'hi': hi})
+        stage['rows_out'] = len(df)
+    return df
+
+def session_date_span(file_path: str):
+    """Returns the first and last launch days of a report as YYYY-MM-DD"""
+    meta = open_dataset(file_path)['meta']
+    if meta['n_valid'] == 0:
+        today = datetime.date.today().isoformat()
+        return today, today
+    return meta['first'].strftime('%Y-%m-%d'), meta['latest'].strftime('%Y-%m-%d')
+
+def format_sessions_for_display(df: pd.DataFrame):
+    """Renders datetime columns the way they appear in the report"""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return df
+
+#
+# Raw dataset table: Wave only gets one page of rows at a time. Sorting,
+# searching and filtering happen server side over the whole timeline,
+# on the session store DataFrame or, for streamed reports, in SQL.
+#
+RAW_TABLE_ROWS_PER_PAGE = 100
+RAW_TABLE_FILTER_COLUMNS = ['username', 'version', 'session_state']
+RAW_TABLE_MAX_FILTERS = 200
+RAW_TABLE_EVENTS = ['sort', 'search', 'filter', 'page_change', 'reset']
+
+def new_raw_table_view():
+    """Returns the unsorted, unfiltered view of the raw table"""
+    return {'sort': None, 'search': None, 'filters': None, 'offset': 0, 'key': None, 'positions': None}
+
+def raw_table_filter_options(file_path: str):
+    """Returns the values offered by the filterable columns of the raw table"""
+    entry = open_dataset(file_path)
+    if 'filter_options' in entry:
+        return entry['filter_options']
+
+    options = {}
+    for col in RAW_TABLE_FILTER_COLUMNS:
+        if col not in entry['meta']['columns']:
+            continue
+        if entry['sessions'] is not None:
+            values = entry['sessions'][col].dropna().astype(str).unique().tolist()
+        else:
+            qq = 'select distinct cast("{0}" as text) as value from sessions where "{0}" is not null'.format(col)
+            values = pd.read_sql_query(qq, analytics_engine(entry['db_path']))['value'].tolist()
+        if len(values) <= RAW_TABLE_MAX_FILTERS:
+            options[col] = sorted(values)
+
+    entry['filter_options'] = options
+    return options
+
+def raw_table_positions(df: pd.DataFrame, view: dict):
+    """Returns the row positions of df that match the view's search and filters, in its sort order"""
+    mask = np.ones(len(df), dtype=bool)
+
+    for col, values in (view['filters'] or {}).items():
+        if values and col in df.columns:
+            mask &= df[col].astype(str).isin(values).to_numpy()
+
+    search = view['search']
+    if search and search.get('value'):
+        found = np.zeros(len(df), dtype=bool)
+        for col in search.get('cols') or df.columns:
+            if col in df.columns:
+                found |= df[col].astype(str).str.contains(search['value'], case=False, regex=False).to_numpy()
+        mask &= found
+
+    positions = np.flatnonzero(mask)
+    for col, descending in (view['sort'] or {}).items():
+        if col in df.columns:
+            order = df[col].iloc[positions].reset_index(drop=True).sort_values(
+                ascending=not descending, kind='stable', na_position='last').index.to_numpy()
+            positions = positions[order]
+    return positions
+
+def raw_table_sql(view: dict, columns: list):
+    """Returns the where and order by clauses, and their parameters, for a view of a streamed report"""
+    where = []
+    params = {}
+
+    for i, (col, values) in enumerate((view['filters'] or {}).items()):
+        if values and col in columns:
+            names = ['f{0}_{1}'.format(i, j) for j in range(len(values))]
+            where.append('cast("{0}" as text) in ({1})'.format(col, ', '.join(':' + x for x in names)))
+            params.update(zip(names, values))
+
+    search = view['search']
+    if search and search.get('value'):
+        cols = [x for x in (search.get('cols') or columns) if x in columns]
+        where.append('(' + ' or '.join('cast("{0}" as text) like :search escape \'\\\''.format(x) for x in cols) + ')')
+        value = search['value'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params['search'] = '%' + value + '%'
+
+    order_by = ['"{0}" {1}'.format(col, 'desc' if descending else 'asc')
+                for col, descending in (view['sort'] or {}).items() if col in columns]
+    return where, order_by + ['rowid'], params
+
+def raw_table_page(file_path: str, timeline: str, view: dict, job: dict = None):
+    """Returns the rows on the view's current page and the number of rows in the view"""
+    entry = open_dataset(file_path, job)
+    lo, hi = dataset_timeline_rows(entry, timeline)
+    offset = view['offset']
+
+    if entry['sessions'] is not None:
+        df = entry['sessions'].iloc[lo:hi]
+        if not (view['sort'] or view['search'] or view['filters']):
+            return df.iloc[offset:offset + RAW_TABLE_ROWS_PER_PAGE], len(df)
+
+        # Remember the matching positions so paging through them is cheap
+        key = (entry['hash'], timeline, repr(view['sort']), repr(view['search']), repr(view['filters']))
+        if view['key'] != key:
+            view['key'] = key
+            view['positions'] = raw_table_positions(df, view)
+        positions = view['positions']
+        return df.iloc[positions[offset:offset + RAW_TABLE_ROWS_PER_PAGE]], len(positions)
+
+    # Streamed reports page through the analytics store
+    where, order_by, params = raw_table_sql(view, entry['meta']['columns'])
+    where = ['rowid > :lo', 'rowid <= :hi'] + where
+    params.update({'lo': lo, 'hi': hi, 'n': RAW_TABLE_ROWS_PER_PAGE, 'offset': offset})
+    qq = 'from sessions where ' + ' and '.join(where)
+
+    engine = analytics_engine(entry['db_path'])
+    page = pd.read_sql_query(sqlalchemy.text('select rowid - 1 as session_row, * ' + qq + ' order by ' +
+                                             ', '.join(order_by) + ' limit :n offset :offset'), engine, params=params)
+    page = fix_session_dtypes(page.set_index('session_row', drop=True).rename_axis(None))
+    if where == ['rowid > :lo', 'rowid <= :hi']:
+        total_rows = hi - lo
+    else:
+        total_rows = int(pd.read_sql_query(sqlalchemy.text('select count(*) as n ' + qq), engine, params=params)['n'][0])
+    return page, total_rows
+
+def make_ui_table_rows(df: pd.DataFrame):
+    """Creates ui.table_row objects named after the position of each session in the report"""
+    df = format_sessions_for_display(df)
+    return [ui.table_row(name=str(i), cells=[str(x) for x in row])
+            for i, row in zip(df.index, df.itertuples(index=False, name=None))]
+
+def make_ui_table(file_path: str, name: str, timeline: str, view: dict):
+    """Creates a paginated ui.table object over the sessions of a report"""
+
+    with diagnostics_stage('page raw table') as stage:
+        page, total_rows = raw_table_page(file_path, timeline, view)
+        stage['rows_in'], stage['rows_out'] = total_rows, len(page)
+    filter_options = raw_table_filter_options(file_path)
+    # Text columns of the report schema, and any other text column it may have
+    searchable = [x for x in page.columns
+                  if x in SESSION_CATEGORY_COLUMNS + SESSION_DATE_COLUMNS or pd.api.types.is_object_dtype(page[x])]
 
     table = ui.table(
             name=name,
-            columns=[ui.table_column(name=str(x), label=str(x), sortable=True) for x in df.columns.values],
-            rows=[ui.table_row(name=str(i), cells=[str(df[col].values[i]) for col in df.columns.values])
-                      for i in range(n_rows)],
-            groupable=True,
+            columns=[ui.table_column(name=str(x), label=str(x), sortable=True, searchable=x in searchable,
+                                     filterable=x in filter_options, filters=filter_options.get(x))
+                     for x in page.columns.values],
+            rows=make_ui_table_rows(page),
+            resettable=True,
+            pagination=ui.table_pagination(total_rows=total_rows, rows_per_page=RAW_TABLE_ROWS_PER_PAGE),
+            events=RAW_TABLE_EVENTS,
     )
     return table
 
-def make_ui_summary(file_path: str, name: str, timeline: str):
+def dashboard_shown(q: Q, file_path: str, timeline: str):
+    """Tells whether the client still shows the dashboard of a report over a timeline"""
+    return (q.client.state == "render_first_page" and q.client.working_file_path == file_path
+            and q.client.timeline == timeline)
+
+async def handle_raw_table_event(q: Q):
+    """Serves a sort, search, filter, page or reset event of the raw dataset table"""
+    event = q.events.head_of_table
+    view = q.client.raw_table_view
+    file_path, timeline = q.client.working_file_path, q.client.timeline
+
+    if event.sort:
+        view['sort'] = event.sort
+        view['offset'] = 0
+    if event.filter:
+        view['filters'] = event.filter
+        view['offset'] = 0
+    if event.search is not None:
+        view['search'] = event.search
+        view['offset'] = 0
+    if event.page_change:
+        view['offset'] = event.page_change.get('offset', 0)
+    if event.reset:
+        q.client.raw_table_view = view = new_raw_table_view()
+
+    out = await run_analytics(q, 'raw_table', 'Searching sessions', raw_table_page, file_path, timeline, view)
+    # Dropped if superseded, or if the dashboard was left or rebuilt in the meantime
+    if out is None or q.client.raw_table_view is not view or not dashboard_shown(q, file_path, timeline):
+        return
+
+    page, total_rows = out
+    table = q.page['table'].items[2].table
+    table.rows = make_ui_table_rows(page)
+    table.pagination = ui.table_pagination(total_rows=total_rows, rows_per_page=RAW_TABLE_ROWS_PER_PAGE)
 
-    sessions = pd.read_csv(file_path)
-    sessions = filter_rows_by_timeline(sessions, timeline)
+#
+# Group by panel: the sessions of a timeline aggregated server side by the
+# picked keys, over all of its rows (chunk by chunk for streamed reports,
+# merging the partial sums). Only the aggregated rows reach the browser.
+# Sessions are split at day (or, grouping by hour, hour) boundaries and
+# clipped to the timeline, so hours and CPU/GPU-hours land on the periods
+# they were used in, for chargeback. Sessions count where they launched.
+#
+GROUP_BY_KEYS = ['username', 'version', 'session_state', 'hour', 'day', 'week', 'month']
+GROUP_BY_PERIOD_FORMATS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d', 'week': '%Y-%m-%d', 'month': '%Y-%m'}
+GROUP_BY_METRICS = {'sessions': 'Sessions', 'hours': 'Hours', 'cpu_hours': 'CPU Hours', 'gpu_hours': 'GPU Hours'}
+GROUP_BY_COLUMNS = ['username', 'version', 'session_state', 'session_launch_unix', 'session_duration_sec',
+                    'cpu_count', 'gpu_count']
+GROUP_BY_MAX_ROWS = 1000
+
+def new_group_by():
+    """Returns the default group by keys and metrics"""
+    return {'keys': ['username'], 'metrics': ['sessions', 'hours']}
+
+def period_starts(starts: pd.Series, key: str):
+    """Returns the start of the hour, day, week (from Monday) or month of each timestamp"""
+    if key == 'hour':
+        return starts
+    days = starts.dt.floor('D')
+    if key == 'week':
+        return days - pd.to_timedelta(days.dt.dayofweek, unit='D')
+    if key == 'month':
+        return days.dt.to_period('M').dt.start_time
+    return days
+
+def session_pieces(sessions: pd.DataFrame, period_sec: int, window: tuple = None):
+    """Splits sessions at multiples of period_sec, clipped to the window's [start, end) unix seconds if given.
+    Returns the partial periods at both ends of each session as pieces (row position, period number, seconds,
+    whether it holds the launch) and the whole periods in between as runs (row position, [first, end) periods)"""
+    def column(col):
+        if col not in sessions.columns:
+            return np.full(len(sessions), np.nan)
+        return sessions[col].to_numpy(dtype='float64')
+
+    launch, duration = column('session_launch_unix'), column('session_duration_sec')
+    timed = ~np.isnan(launch) & ~np.isnan(duration)
+    rows = np.flatnonzero(timed)
+    launch, duration = launch[timed], duration[timed]
+    start, end = launch, launch + np.maximum(duration, 0)
+
+    # Keep what overlaps the window, and whatever launched in it even if it lasted no time
+    if window is not None:
+        launched = (launch >= window[0]) & (launch < window[1])
+        start, end = np.maximum(start, window[0]), np.minimum(end, window[1])
+        keep = (end > start) | launched
+        rows, launch, duration, start, end = rows[keep], launch[keep], duration[keep], start[keep], end[keep]
+        end = np.maximum(end, start)
+
+    # Negative durations are booked as is on the launch period
+    first = np.floor(start / period_sec).astype(np.int64)
+    last = np.maximum(np.ceil(end / period_sec).astype(np.int64) - 1, first)
+    head = np.where(duration < 0, duration, np.minimum(end, (first + 1) * period_sec) - start)
+    tail = last > first
+
+    pieces = pd.DataFrame({
+        'row': np.r_[rows, rows[tail]],
+        'period': np.r_[first, last[tail]].astype('float64'),
+        'seconds': np.r_[head, end[tail] - last[tail] * period_sec],
+        'launched': np.r_[start == launch, np.zeros(tail.sum(), dtype=bool)],
+    })
+    whole = last - first > 1
+    runs = pd.DataFrame({'row': rows[whole], 'first': first[whole] + 1, 'end': last[whole]})
+
+    # Sessions without a launch time or duration stay whole, in no period, and only count unclipped
+    if window is None and not timed.all():
+        untimed = np.flatnonzero(~timed)
+        untimed = pd.DataFrame({'row': untimed, 'period': np.nan,
+                                'seconds': column('session_duration_sec')[untimed], 'launched': True})
+        pieces = pd.concat([pieces, untimed], ignore_index=True)
+    return pieces, runs
+
+def group_period_sec(keys: list):
+    """Returns the length of the periods sessions are split into for the group by keys"""
+    return 3600 if 'hour' in keys else SECONDS_PER_DAY
+
+def run_cells(code: np.ndarray, first: np.ndarray, end: np.ndarray, weights: dict):
+    """Spreads runs of whole periods over the (group code, period) cells they cover, summing their weights.
+    A difference array per group, so each cell is produced once however many runs cover it"""
+    events = pd.DataFrame({'code': np.r_[code, code], 'period': np.r_[first, end]})
+    for name, weight in weights.items():
+        events[name] = np.r_[weight, -weight]
+    events = events.groupby(['code', 'period'], sort=True).sum().reset_index()
+
+    levels = events.groupby('code')[list(weights)].cumsum()
+    lengths = (events.groupby('code')['period'].shift(-1) - events['period']).fillna(0).astype(np.int64)
+    active = np.flatnonzero(levels['sessions'].to_numpy() > 0)
+    lengths = lengths.to_numpy()[active]
+
+    index = np.repeat(active, lengths)
+    offset = np.arange(len(index)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cells = levels.iloc[index].reset_index(drop=True)
+    cells.insert(0, 'period', (events['period'].to_numpy()[index] + offset).astype('float64'))
+    cells.insert(0, 'code', events['code'].to_numpy()[index])
+    return cells
+
+def group_chunk(chunk: pd.DataFrame, keys: list, window: tuple = None):
+    """Sums the sessions launched, hours and CPU/GPU hours of a chunk of sessions per group.
+    Period keys are grouped by period number, see label_periods"""
+    period_sec = group_period_sec(keys)
+    pieces, runs = session_pieces(chunk, period_sec, window)
+    names = [key for key in keys if key not in GROUP_BY_PERIOD_FORMATS]
+    by_period = len(names) < len(keys)
+
+    # Number the groups of the non period keys, session by session
+    key_values = pd.DataFrame({key: chunk[key].to_numpy(dtype=object) if key in chunk.columns else np.nan
+                               for key in names}, index=np.arange(len(chunk)))
+    if names:
+        grouped = key_values.groupby(names, dropna=False, sort=False)
+        codes, key_values = grouped.ngroup().to_numpy(), grouped.head(1).reset_index(drop=True)
+    else:
+        codes, key_values = np.zeros(len(chunk), dtype=np.int64), pd.DataFrame(index=[0])
+
+    def weight(col, rows):
+        if col not in chunk.columns:
+            return np.full(len(rows), np.nan)
+        return chunk[col].to_numpy(dtype='float64')[rows]
+
+    rows = pieces['row'].to_numpy()
+    hours = pieces['seconds'].to_numpy() / 3600
+    cells = [pd.DataFrame({'code': codes[rows], 'period': pieces['period'].to_numpy() if by_period else np.nan,
+                           'sessions': pieces['launched'].astype(int).to_numpy(), 'hours': hours,
+                           'cpu_hours': hours * weight('cpu_count', rows),
+                           'gpu_hours': hours * weight('gpu_count', rows)})]
+
+    # Whole periods in the middle of long sessions, without a row per period and session
+    if len(runs):
+        rows = runs['row'].to_numpy()
+        hours = np.full(len(rows), period_sec / 3600)
+        cpus, gpus = np.nan_to_num(weight('cpu_count', rows)), np.nan_to_num(weight('gpu_count', rows))
+        if by_period:
+            spread = run_cells(codes[rows], runs['first'].to_numpy(), runs['end'].to_numpy(),
+                               {'sessions': np.ones(len(rows)), 'cpus': cpus, 'gpus': gpus})
+            cells.append(pd.DataFrame({'code': spread['code'], 'period': spread['period'], 'sessions': 0,
+                                       'hours': spread['sessions'] * period_sec / 3600,
+                                       'cpu_hours': spread['cpus'] * period_sec / 3600,
+                                       'gpu_hours': spread['gpus'] * period_sec / 3600}))
+        else:
+            hours = hours * (runs['end'] - runs['first']).to_numpy()
+            cells.append(pd.DataFrame({'code': codes[rows], 'period': np.nan, 'sessions': 0, 'hours': hours,
+                                       'cpu_hours': hours * cpus, 'gpu_hours': hours * gpus}))
+
+    sums = pd.concat(cells, ignore_index=True).groupby(['code', 'period'], dropna=False, sort=False).sum()
+    sums = sums.reset_index()
+    sums = pd.concat([key_values.iloc[sums['code'].to_numpy()].reset_index(drop=True),
+                      sums.drop(columns='code')], axis=1)
+    if not by_period:
+        sums = sums.drop(columns='period')
+    return sums.set_index(names + (['period'] if by_period else []))
+
+def label_periods(groups: pd.DataFrame, keys: list):
+    """Turns the period numbers of grouped sums into the hour, day, week or month keys, summing them up"""
+    if 'period' not in groups.columns:
+        return groups
+
+    starts = pd.Series(pd.to_datetime(groups['period'].to_numpy() * group_period_sec(keys), unit='s'))
+    for key in keys:
+        if key in GROUP_BY_PERIOD_FORMATS:
+            groups[key] = period_starts(starts, key).to_numpy()
+    return groups.groupby(keys, dropna=False, sort=False)[list(GROUP_BY_METRICS)].sum().reset_index()
+
+def group_sessions(file_path: str, timeline: str, group_by: dict, job: dict = None):
+    """Aggregates the sessions of a report over a timeline, returning the top groups and the number of groups"""
+    entry = open_dataset(file_path, job)
+    lo, hi = dataset_timeline_rows(entry, timeline)
+    keys = [x for x in group_by['keys'] if x in GROUP_BY_KEYS] or new_group_by()['keys']
+    metrics = [x for x in group_by['metrics'] if x in GROUP_BY_METRICS] or new_group_by()['metrics']
+
+    # Clip to the timeline's days, reaching back for sessions that ran into them
+    window = None
+    if timeline != 'All':
+        rollup = entry['rollup']
+        a, b = rollup_window(rollup, entry['meta'], timeline)
+        window = ((rollup['first_day'] + a) * SECONDS_PER_DAY, (rollup['first_day'] + b) * SECONDS_PER_DAY)
+        reach = pd.Timestamp(window[0] - (rollup['span_days'] + 1) * SECONDS_PER_DAY, unit='s')
+        lo = min(lo, dataset_launch_position(entry)(reach))
+
+    with diagnostics_stage('group sessions', rows_in=hi - lo) as stage:
+        # In memory sessions go in bounded slices too, like streamed ones
+        parts = []
+        for chunk in session_chunks(entry, lo, hi, GROUP_BY_COLUMNS):
+            for i in range(0, len(chunk), INGEST_CHUNK_ROWS):
+                report_progress(job, 'Grouping sessions')
+                parts.append(group_chunk(chunk.iloc[i:i + INGEST_CHUNK_ROWS], keys, window))
+
+        if parts:
+            groups = pd.concat(parts)
+            groups = groups.groupby(level=list(range(groups.index.nlevels)), dropna=False, sort=False).sum()
+            groups = label_periods(groups.reset_index(), keys)
+            groups = groups.sort_values(metrics[0], ascending=False, kind='stable')
+        else:
+            groups = pd.DataFrame(columns=keys + list(GROUP_BY_METRICS))
+        stage['rows_out'] = len(groups)
+
+    top = groups.head(GROUP_BY_MAX_ROWS).copy()
+    for key, date_format in GROUP_BY_PERIOD_FORMATS.items():
+        if key in keys and pd.api.types.is_datetime64_any_dtype(top[key]):
+            top[key] = top[key].dt.strftime(date_format)
+    top = top[keys + metrics].rename(columns=GROUP_BY_METRICS)
+    return top.round(2), len(groups)
+
+def make_group_by_card(file_path: str, timeline: str, group_by: dict, job: dict = None):
+    """Creates the group by card of a report over a timeline"""
+    group_by = group_by or new_group_by()
+    key = (open_dataset(file_path, job)['hash'], timeline, 'group_by', tuple(group_by['keys']), tuple(group_by['metrics']))
+    groups, n_groups = cached_result(key, lambda: group_sessions(file_path, timeline, group_by, job))
+
+    items = [
+        ui.separator(label=DASHBOARD_CARDS['group_by'][1]),
+        ui.inline(items=[
+            ui.dropdown(name='group_keys', label='Keys', values=group_by['keys'],
+                        choices=[ui.choice(x, x) for x in GROUP_BY_KEYS]),
+            ui.dropdown(name='group_metrics', label='Metrics', values=group_by['metrics'],
+                        choices=[ui.choice(x, label) for x, label in GROUP_BY_METRICS.items()]),
+            ui.button(name='group_button', label='Group', primary=True),
+        ]),
+    ]
+    if n_groups > len(groups):
+        items.append(ui.text_s('Top {0} of {1} groups'.format(len(groups), n_groups)))
+    items.append(ui.table(
+            name='group_by_table',
+            columns=[ui.table_column(name=str(x), label=str(x), sortable=True,
+                                     data_type='number' if x in GROUP_BY_METRICS.values() else 'string')
+                     for x in groups.columns],
+            rows=[ui.table_row(name=str(i), cells=['' if pd.isna(x) else str(x) for x in row])
+                  for i, row in enumerate(groups.itertuples(index=False, name=None))],
+            downloadable=True
+    ))
+    return ui.form_card(box=DASHBOARD_CARDS['group_by'][0], items=items)
+
+async def handle_group_by(q: Q):
+    """Re-aggregates the group by card with the keys and metrics picked by the user"""
+    q.client.group_by = {'keys': q.args.group_keys or new_group_by()['keys'],
+                         'metrics': q.args.group_metrics or new_group_by()['metrics']}
+    file_path, timeline = q.client.working_file_path, q.client.timeline
+    out = await run_analytics(q, 'group_by', 'Grouping sessions', make_group_by_card,
+                              file_path, timeline, q.client.group_by)
+    # Dropped if superseded, or if the dashboard was left in the meantime
+    if out is None or not dashboard_shown(q, file_path, timeline):
+        return
+    q.page['group_by'] = out
 
-    #
-    # no. of rows and cols
-    #
-    
-    n_rows = sessions.shape[0]
-    n_cols = sessions.shape[1]
+#
+# Active sessions: who was active at a peak. On the first query of an
+# in-memory report each finished session, the ones peak usage counts, gets
+# its interval [launch, end] in an interval index, a centered interval
+# tree laid out implicitly over the sorted launch times: node x is
+# centered on the x-th launch and its children are x minus and plus half
+# its lowest set bit. A session sits on the highest node whose center it
+# covers, the multiple of the largest power of 2 among the launches it
+# covers, found for all sessions at once. Each node keeps its sessions by
+# start and by end, so those active at T are found by a binary search on
+# each node of one root to leaf walk. Those active in [T1, T2) are the
+# ones active at T1 plus those launched after, a slice of the launch
+# order: O(log^2 n + k) for k sessions. Streamed reports are not held in
+# memory, so neither is their index: they are queried over the indexed
+# launch and end columns of the analytics store.
+#
+ACTIVE_SESSION_COLUMNS = ['session_state', 'session_launch_unix', 'session_end_unix']
+ACTIVE_SESSION_MAX_ROWS = 500
+ACTIVE_HOURS = ['All day'] + ['{0:02d}:00'.format(x) for x in range(24)]
+
+def build_interval_index(launch: np.ndarray, end: np.ndarray):
+    """Builds the interval index of sessions [launch, end] by position, leaving out those without both"""
+    valid = ~np.isnan(launch) & ~np.isnan(end) & (end >= launch)
+    positions = np.flatnonzero(valid).astype(np.int32)
+    start, end = launch[valid], end[valid]
+
+    order = np.argsort(start, kind='stable')
+    centers = start[order]
+    depth = max(len(centers).bit_length(), 1)
+
+    # Sessions cover the centers lo..hi (1-based) and sit on the one of them
+    # divisible by the largest power of 2, the highest in the tree
+    lo = np.searchsorted(centers, start, side='left') + 1
+    hi = np.searchsorted(centers, end, side='right')
+    level = bit_lengths((lo - 1) ^ hi) - 1
+    node = (hi >> level) << level
+
+    by_start = np.lexsort((start, node))
+    by_end = np.lexsort((-end, node))
+    return {
+        'depth': depth,
+        'centers': centers,
+        'launch_positions': positions[order],
+        'ptr': np.r_[0, np.cumsum(np.bincount(node, minlength=2 ** depth))],
+        'starts': start[by_start],
+        'start_positions': positions[by_start],
+        'neg_ends': -end[by_end],
+        'end_positions': positions[by_end],
+    }
+
+def build_session_intervals(entry: dict, job: dict = None):
+    """Builds the interval index of the finished sessions of a store entry"""
+    with diagnostics_stage('index session intervals', rows_in=entry['meta']['n_rows']) as stage:
+        launch, end = [], []
+        for chunk in session_chunks(entry, columns=ACTIVE_SESSION_COLUMNS):
+            report_progress(job, 'Indexing sessions')
+            finished = (chunk['session_state'] == 'finished').to_numpy()
+            launch.append(np.where(finished, chunk['session_launch_unix'].to_numpy(dtype='float64'), np.nan))
+            end.append(np.where(finished, chunk['session_end_unix'].to_numpy(dtype='float64'), np.nan))
+
+        index = build_interval_index(np.concatenate(launch) if launch else np.empty(0),
+                                     np.concatenate(end) if end else np.empty(0))
+        stage['rows_out'] = len(index['centers'])
+    return index
+
+def session_intervals(entry: dict):
+    """Returns the interval index of an in-memory store entry, building it on first use"""
+    with entry['lock']:
+        if 'intervals' not in entry:
+            entry['intervals'] = build_session_intervals(entry)
+            entry['nbytes'] += result_nbytes(entry['intervals'])
+    return entry['intervals']
+
+def interval_stab(index: dict, t: float):
+    """Returns the positions of the sessions of an interval index active at t"""
+    centers, ptr = index['centers'], index['ptr']
+    found = []
+    node = 2 ** (index['depth'] - 1)
+    while True:
+        a, b = ptr[node], ptr[node + 1]
+        center = centers[node - 1] if node <= len(centers) else np.inf
+        step = (node & -node) >> 1
+        if t < center:
+            found.append(index['start_positions'][a:a + np.searchsorted(index['starts'][a:b], t, side='right')])
+        elif t > center:
+            found.append(index['end_positions'][a:a + np.searchsorted(index['neg_ends'][a:b], -t, side='right')])
+        else:
+            found.append(index['start_positions'][a:b])
+            break
+        if step == 0:
+            break
+        node = node - step if t < center else node + step
+    return np.concatenate(found)
+
+def interval_overlaps(index: dict, t1: float, t2: float):
+    """Returns the positions, in order, of the sessions of an interval index active at some time in [t1, t2)"""
+    centers = index['centers']
+    launched = index['launch_positions'][np.searchsorted(centers, t1, side='right'):
+                                         np.searchsorted(centers, t2, side='left')]
+    return np.sort(np.r_[interval_stab(index, t1), launched])
+
+def overlapping_sessions(entry: dict, t1: float, t2: float):
+    """Returns the finished sessions of a store entry active at some time in [t1, t2), indexed by position"""
+    if entry['sessions'] is not None:
+        return entry['sessions'].iloc[interval_overlaps(session_intervals(entry), t1, t2)]
+
+    # Sessions launched at most the longest duration before t1 are a range of the launch index
+    engine = analytics_engine(entry['db_path'])
+    with entry['lock']:
+        if 'longest_session' not in entry:
+            qq = """
+                select max(session_end_unix - session_launch_unix) from sessions
+                where session_state = 'finished' and session_end_unix >= session_launch_unix
+                """
+            with engine.connect() as conn:
+                entry['longest_session'] = conn.execute(sqlalchemy.text(qq)).scalar() or 0
 
+    qq = """
+        select rowid - 1 as session_row, * from sessions
+        where session_launch_unix >= :t0 and session_launch_unix < :t2 and session_end_unix >= :t1
+            and session_end_unix >= session_launch_unix and +session_state = 'finished'
+        order by rowid
+        """
+    rows = pd.read_sql_query(sqlalchemy.text(qq), engine,
+                             params={'t0': t1 - entry['longest_session'], 't1': t1, 't2': t2})
+    return fix_session_dtypes(rows.set_index('session_row', drop=True))
+
+def active_sessions(file_path: str, day: str, hour: int = None):
+    """Returns the first sessions of a report active on a day (or an hour of it), their count and per-user totals"""
+    entry = open_dataset(file_path)
+    t1 = pd.Timestamp(day).normalize().value / 10**9 + 3600 * (hour or 0)
+    t2 = t1 + (SECONDS_PER_DAY if hour is None else 3600)
+
+    def compute():
+        with diagnostics_stage('find active sessions') as stage:
+            sessions = overlapping_sessions(entry, t1, t2)
+            stage['rows_out'] = len(sessions)
+
+        def column(col: str, fill):
+            return sessions[col].astype(object) if col in sessions.columns else pd.Series(fill, index=sessions.index)
+
+        users = pd.DataFrame({
+            'User': column('username', 'N/A').fillna('N/A'),
+            'Sessions': 1,
+            'CPUs': pd.to_numeric(column('cpu_count', 0)).fillna(0),
+            'GPUs': pd.to_numeric(column('gpu_count', 0)).fillna(0),
+        }).groupby('User', sort=False).sum().sort_values(['CPUs', 'Sessions'], ascending=False).reset_index()
+        return sessions.head(ACTIVE_SESSION_MAX_ROWS), len(sessions), users
+
+    return cached_result((entry['hash'], 'active_sessions', day, hour), compute)
+
+def make_active_sessions_card(file_path: str, active: dict, job: dict = None):
+    """Creates the card listing the sessions active on a picked day or hour, with per-user CPU and GPU totals"""
+    first_date, last_date = session_date_span(file_path)
+    day = None if active is None else active['day']
+    hour = None if active is None else active['hour']
+
+    items = [
+        ui.separator(label='Active Sessions'),
+        ui.inline(items=[
+            ui.date_picker(name='active_day', label='Day', value=day, min=first_date, max=last_date),
+            ui.dropdown(name='active_hour', label='Hour (UTC)', value=ACTIVE_HOURS[0 if hour is None else hour + 1],
+                        choices=[ui.choice(x, x) for x in ACTIVE_HOURS]),
+            ui.button(name='active_button', label='Show', primary=True),
+        ]),
+    ]
+    if day is None:
+        items.append(ui.text_s('Click a day of the peak usage table, or pick a day or hour, to list its sessions'))
+        return ui.form_card(box='1 22 11 7', items=items)
+
+    report_progress(job, 'Finding active sessions')
+    sessions, n_sessions, users = active_sessions(file_path, day, hour)
+    when = day if hour is None else '{0} {1} UTC'.format(day, ACTIVE_HOURS[hour + 1])
+    caption = '{0} sessions active on {1} ({2} users)'.format(n_sessions, when, len(users))
+    if n_sessions > len(sessions):
+        caption += ', first {0} listed'.format(len(sessions))
+    items.append(ui.text_s(caption))
+    items.append(ui.table(
+            name='active_users',
+            columns=[ui.table_column(name=x, label=x, sortable=True, data_type='string' if x == 'User' else 'number')
+                     for x in users.columns],
+            rows=[ui.table_row(name=str(i), cells=[str(x) for x in row])
+                  for i, row in enumerate(users.itertuples(index=False, name=None))],
+            downloadable=True
+    ))
+    items.append(ui.table(
+            name='active_sessions_table',
+            columns=[ui.table_column(name=str(x), label=str(x), sortable=True) for x in sessions.columns],
+            rows=make_ui_table_rows(sessions),
+            downloadable=True
+    ))
+    return ui.form_card(box='1 22 11 7', items=items)
+
+async def handle_active_sessions(q: Q):
+    """Lists the sessions active on the day clicked in the peak usage table, or on the day or hour picked"""
+    if q.args.peak_by_day_stats:
+        q.client.active_sessions = {'day': q.args.peak_by_day_stats[0], 'hour': None}
+    elif q.args.active_day:
+        hour = ACTIVE_HOURS.index(q.args.active_hour) if q.args.active_hour in ACTIVE_HOURS else 0
+        q.client.active_sessions = {'day': q.args.active_day, 'hour': hour - 1 if hour else None}
+    file_path, active = q.client.working_file_path, q.client.active_sessions
+    out = await run_analytics(q, 'active', 'Finding active sessions', make_active_sessions_card, file_path, active)
+    # Dropped if superseded, or if another report was uploaded in the meantime
+    if out is None or q.client.working_file_path != file_path or q.client.active_sessions is not active:
+        return
+    q.page['active_sessions'] = out
 
-    #
-    # Hours
-    #
+#
+# Summary KPIs: over a timeline other than All, Total Sessions counts the
+# sessions launched in it while the other totals count activity on its
+# days, so that a session running into the window has its hours and user
+# counted. Those rows say which definition they use.
+#
+SUMMARY_WINDOW_DEFINITIONS = {
+    'Log Starts': 'first launch in range',
+    'Log Ends': 'last end in range',
+    'Total Hours of Use': 'use within range',
+    'Total Sessions': 'launched in range',
+    '# of Unique Users': 'active in range',
+    '# of Unique Product Versions': 'active in range',
+}
 
-    qq = "select sum(session_duration_sec)/3600 as hours from sessions"
-    hd = psql.sqldf(qq,locals())
-    hours = round(hd['hours'].values[0],2)
-    
-    #
-    # Min and Max timestamps
-    #
-    qq = """
-                    select min(datetime(session_launch_unix,'unixepoch')) as min_ts, 
-                               max(datetime(session_end_unix,'unixepoch')) as max_ts 
-                    from sessions
-                    where session_state='finished'
-            """
+def round_kpi(value):
+    """Rounds a KPI to 2 decimals, N/A when there was nothing to aggregate"""
+    if value is None or pd.isna(value):
+        return "N/A"
+    return round(value,2)
 
-    min_max_ts = psql.sqldf(qq, locals())
-    
-    min_ts = min_max_ts['min_ts'].values[0]  
-    max_ts = min_max_ts['max_ts'].values[0]
+def make_ui_summary(results: dict, name: str):
+
+    df_render = summary_kpis(results)
+
+    table = ui.table(
+            name=name,
+            columns=[ui.table_column(name=str(x), label=str(x), sortable=True) for x in df_render.columns.values],
+            rows=[ui.table_row(name=str(i), cells=[str(df_render[col].values[i]) for col in df_render.columns.values])
+                      for i in range(14)],
+            downloadable=True
+    )
+    return table
+
+def summary_kpis(results: dict):
+    """Returns the KPI, Values table of the summary view"""
 
-    min_ts = datetime.datetime.strptime(min_ts, '%Y-%m-%d %H:%M:%S').strftime("%c")
-    max_ts = datetime.datetime.strptime(max_ts, '%Y-%m-%d %H:%M:%S').strftime("%c")
-    
-    # 
-    # Aggregate stats on users and products
     #
-    if 'username' in sessions.columns:
-                    qq = """
-                                    select count(distinct username) as unique_users, 
-                                               count(distinct version) as unique_versions
-                                    from sessions
-                                    where session_state='finished'
-                            """
-
-                    agg_users_products = psql.sqldf(qq, locals())
-                    users = agg_users_products['unique_users'].values[0]
-                    versions = agg_users_products['unique_versions'].values[0]
-    else:
-            users = "N/A"
-            versions= "N/A"
+    # Rows, hours, timestamps, users and products, all from the daily rollup
+    #
+    summary = results['summary']
+
+    n_rows = summary['n_rows']
+    hours = round_kpi(summary['hours'])
+    min_ts = summary['min_ts']
+    max_ts = summary['max_ts']
+    users = summary['unique_users']
+    versions = summary['unique_versions']
 
     # 
-    # Load Peak usage file and do analytics
+    # Analytics on the daily peak usage
     #
-    peak_usage = pd.read_csv("data/peak_usage.csv")
+    peak_usage = results['peak_usage']
 
-    qq = """
-                    select max(unique_users) as max_daily_peak,
-                               avg(unique_users) as avg_daily_peak,
-                               max(peak_cpus) as max_daily_cpus,
-                               avg(peak_cpus) as avg_daily_cpus,
-                               max(peak_gpus) as max_daily_gpus,
-                               avg(peak_gpus) as avg_daily_gpus,
-                               sum(case when unique_users > 0 then 1 else 0 end) as total_days_used,
-                               sum(case when unique_users = 0 then 1 else 0 end) as total_days_not_used
-                            from peak_usage
-            """
-    agg_peak = psql.sqldf(qq,locals())
-    max_daily_peak = agg_peak['max_daily_peak'].values[0]
-    avg_daily_peak = round(agg_peak['avg_daily_peak'].values[0],2)
-    max_daily_cpus = agg_peak['max_daily_cpus'].values[0]
-    avg_daily_cpus = round(agg_peak['avg_daily_cpus'].values[0],2)
-    max_daily_gpus = agg_peak['max_daily_gpus'].values[0]
-    avg_daily_gpus = round(agg_peak['avg_daily_gpus'].values[0],2)
-    total_days_used = agg_peak['total_days_used'].values[0]
-    total_days_not_used = agg_peak['total_days_not_used'].values[0]
+    max_daily_peak = round_kpi(peak_usage['Unique Users'].max())
+    avg_daily_peak = round_kpi(peak_usage['Unique Users'].mean())
+    max_daily_cpus = round_kpi(peak_usage['Peak CPUs'].max())
+    avg_daily_cpus = round_kpi(peak_usage['Peak CPUs'].mean())
+    max_daily_gpus = round_kpi(peak_usage['Peak GPUs'].max())
+    avg_daily_gpus = round_kpi(peak_usage['Peak GPUs'].mean())
+    total_days_used = int((peak_usage['Unique Users'] > 0).sum())
+    total_days_not_used = int((peak_usage['Unique Users'] == 0).sum())
 
     #
     # Load the aggregates into a list
@@ -301,152 +1817,820 @@ def make_ui_summary(file_path: str, name: str, timeline: str):
                     ['Total Days Not Used',total_days_not_used]
                ]
 
-    #
-    # Ready to render results 
-    #
-    df_render = pd.DataFrame(data, columns = ['KPI', 'Values'])
+    if results['timeline'] != 'All':
+        data = [['{0} ({1})'.format(kpi, SUMMARY_WINDOW_DEFINITIONS[kpi]) if kpi in SUMMARY_WINDOW_DEFINITIONS else kpi,
+                 value] for kpi, value in data]
 
-    table = ui.table(
-            name=name,
-            columns=[ui.table_column(name=str(x), label=str(x), sortable=True) for x in df_render.columns.values],
-            rows=[ui.table_row(name=str(i), cells=[str(df_render[col].values[i]) for col in df_render.columns.values])
-                      for i in range(14)],
-            downloadable=True
-    )
-    return table
+    return pd.DataFrame(data, columns = ['KPI', 'Values'])
 
 
-def make_ui_processed(file_path: str, name: str, timeline: str):
+#
+# Peak usage engine: a session counts towards every (UTC) day between the
+# day it was launched and the day it ended. Rather than joining every
+# session against every day, each session adds +1/-1 at the edges of its
+# day interval in a difference array and a cumulative sum gives the daily
+# totals, O(sessions + days).
+#
+SECONDS_PER_DAY = 86400
 
-    sessions = pd.read_csv(file_path)
+def session_day_intervals(sessions: pd.DataFrame):
+    """Returns the finished sessions with their launch and end day numbers since the epoch"""
+    finished = sessions[sessions['session_state'] == 'finished']
+    start_day = np.floor(finished['session_launch_unix'].to_numpy(dtype='float64') / SECONDS_PER_DAY)
+    end_day = np.floor(finished['session_end_unix'].to_numpy(dtype='float64') / SECONDS_PER_DAY)
+    return finished, start_day, end_day
 
-    sessions = filter_rows_by_timeline(sessions, timeline)
+def merge_named_intervals(names: np.ndarray, start: np.ndarray, end: np.ndarray):
+    """Merges the overlapping day intervals of each name (user, version) so every name counts once per day"""
+    order = np.lexsort((start, names))
+    names, start, end = names[order], start[order], end[order]
 
-    #
-    # Min and Max timestamps
-    #
-    qq = """
-                    select min(datetime(session_launch_unix,'unixepoch')) as min_ts, 
-                               max(datetime(session_end_unix,'unixepoch')) as max_ts 
-                    from sessions
-                    where session_state='finished'
-            """
+    # Running max of the interval ends seen so far for the same name
+    reach = pd.Series(end).groupby(names).cummax().to_numpy()
+    new_name = np.r_[True, names[1:] != names[:-1]]
+    new_block = new_name | np.r_[True, start[1:] > reach[:-1]]
 
-    min_max_ts = psql.sqldf(qq, locals())
-    min_ts = min_max_ts['min_ts'].values[0]
-    max_ts = min_max_ts['max_ts'].values[0]
+    block_start = start[new_block]
+    block_end = np.maximum.reduceat(end, np.flatnonzero(new_block)) if len(end) else end
+    return names[new_block], block_start, block_end
 
-    # 
-    # Aggregate stats on users and products
-    #
-    if 'ownerN' in sessions.columns:
-            qq = """
-                            select count(distinct username) as unique_users, 
-                                       count(distinct version) as unique_versions 
-                            from sessions
-                            where session_state='finished'
-                    """
-
-            agg_users_products = psql.sqldf(qq, locals())
-            users = agg_users_products['unique_users'].values[0]
-            versions = agg_users_products['unique_versions'].values[0]
+#
+# Usage totals: the per-day counters behind the daily rollup are kept in a
+# form that can be updated one chunk of sessions at a time. Day deltas are
+# indexed by day number since the epoch and per-user (and per-version)
+# intervals are re-merged after every chunk, so their size is bounded by
+# days and users rather than by the number of sessions.
+#
+PEAK_USAGE_COLUMNS = ['Day Present', 'Peak Sessions', 'Peak CPUs', 'Peak GPUs', 'Unique Users',
+                      'Max Concurrent Sessions', 'Max Concurrent CPUs', 'Max Concurrent GPUs']
+PEAK_USAGE_FIELDS = ['day_present', 'peak_sessions', 'peak_cpus', 'peak_gpus', 'unique_users',
+                     'max_concurrent_sessions', 'max_concurrent_cpus', 'max_concurrent_gpus']
+PEAK_WEIGHT_COLUMNS = {'cpus': 'cpu_count', 'gpus': 'gpu_count'}
+NAMED_INTERVAL_COLUMNS = {'user_intervals': 'username', 'version_intervals': 'version'}
+# Seconds of use per day, plain and weighted by CPUs and GPUs ('cpus_full', ...)
+DAY_SECONDS_COLUMNS = ['full', 'trim'] + [key + '_' + part for key in PEAK_WEIGHT_COLUMNS for part in ['full', 'trim']]
+
+def new_named_intervals(col: str):
+    """Returns an empty frame of merged day intervals per name"""
+    return pd.DataFrame({col: pd.Series(dtype=object),
+                         'start': pd.Series(dtype=np.int64),
+                         'end': pd.Series(dtype=np.int64)})
+
+def new_usage_totals():
+    """Returns empty usage totals"""
+    return {
+        'n_rows': 0,
+        'duration_is_float': False,
+        'has_username': False,
+        'first_day': np.nan,
+        'last_day': np.nan,
+        'use_first_day': np.nan,
+        'use_last_day': np.nan,
+        'span_days': 0,
+        'day_deltas': pd.DataFrame(columns=['sessions', 'cpus', 'gpus'], dtype='float64'),
+        'day_seconds': pd.DataFrame(columns=DAY_SECONDS_COLUMNS, dtype='float64'),
+        'day_extremes': pd.DataFrame(columns=['min_launch', 'max_end'], dtype='float64'),
+        'slot_deltas': pd.DataFrame(columns=['sessions', 'cpus', 'gpus'], dtype='float64'),
+        'float_weights': set(),
+        'user_intervals': new_named_intervals('username'),
+        'version_intervals': new_named_intervals('version'),
+    }
+
+def update_usage_totals(totals: dict, sessions: pd.DataFrame):
+    """Folds a chunk of sessions into the usage totals"""
+    totals['n_rows'] += len(sessions)
+
+    if 'session_duration_sec' in sessions.columns:
+        totals['duration_is_float'] |= pd.api.types.is_float_dtype(sessions['session_duration_sec'])
+        update_day_seconds(totals, sessions)
+
+    if 'username' in sessions.columns:
+        totals['has_username'] = True
+
+    for key, col in PEAK_WEIGHT_COLUMNS.items():
+        if col in sessions.columns and pd.api.types.is_float_dtype(sessions[col]):
+            totals['float_weights'].add(key)
+
+    finished, start_day, end_day = session_day_intervals(sessions)
+
+    if not np.isnan(start_day).all():
+        totals['first_day'] = np.fmin(totals['first_day'], np.nanmin(start_day))
+    if not np.isnan(end_day).all():
+        totals['last_day'] = np.fmax(totals['last_day'], np.nanmax(end_day))
+
+    # Widest gap between the launch and end days of a session, either way
+    gaps = np.abs(end_day - start_day)
+    if not np.isnan(gaps).all():
+        totals['span_days'] = max(totals['span_days'], int(np.nanmax(gaps)))
+
+    # First launch and last end of the finished sessions, per day
+    extremes = pd.concat([
+        totals['day_extremes'],
+        pd.DataFrame({'min_launch': finished['session_launch_unix'].to_numpy(dtype='float64'),
+                      'max_end': np.nan}, index=start_day),
+        pd.DataFrame({'min_launch': np.nan,
+                      'max_end': finished['session_end_unix'].to_numpy(dtype='float64')}, index=end_day),
+    ])
+    extremes = extremes[extremes.index.notna()]
+    totals['day_extremes'] = extremes.groupby(level=0).agg({'min_launch': 'min', 'max_end': 'max'})
+
+    # Sessions without both timestamps, or ending before they start, never touch a day
+    valid = ~np.isnan(start_day) & ~np.isnan(end_day) & (end_day >= start_day)
+    if not valid.any():
+        return totals
+
+    start = start_day[valid].astype(np.int64)
+    end = end_day[valid].astype(np.int64)
+    finished = finished[valid]
+
+    # +1/-1 (or +cpus/-cpus) at the edges of each session's day interval
+    base = int(start.min())
+    n_days = int(end.max()) - base + 1
+    deltas = {'sessions': day_interval_deltas(start - base, end - base, n_days)}
+    for key, col in PEAK_WEIGHT_COLUMNS.items():
+        weights = finished[col].fillna(0).to_numpy(dtype='float64') if col in finished.columns else None
+        deltas[key] = day_interval_deltas(start - base, end - base, n_days, weights) if weights is not None \
+            else np.zeros(n_days + 1)
+    chunk_deltas = pd.DataFrame(deltas, index=np.arange(base, base + n_days + 1))
+    totals['day_deltas'] = totals['day_deltas'].add(chunk_deltas, fill_value=0)
+
+    update_slot_deltas(totals, finished)
+
+    # Distinct users and versions per day, without expanding sessions into days
+    for key, col in NAMED_INTERVAL_COLUMNS.items():
+        if col not in finished.columns:
+            continue
+        named = finished[col].notna().to_numpy()
+        intervals = pd.concat([totals[key], pd.DataFrame({
+            col: finished[col].to_numpy()[named],
+            'start': start[named],
+            'end': end[named],
+        })], ignore_index=True)
+        codes, names = pd.factorize(intervals[col])
+        codes, name_start, name_end = merge_named_intervals(codes, intervals['start'].to_numpy(),
+                                                            intervals['end'].to_numpy())
+        totals[key] = pd.DataFrame({col: names.to_numpy()[codes], 'start': name_start, 'end': name_end})
+
+    return totals
+
+def update_day_seconds(totals: dict, sessions: pd.DataFrame):
+    """Folds the seconds (and CPU and GPU-seconds) of use of a chunk of sessions into the totals, clipped to each day"""
+    launch = sessions['session_launch_unix'].to_numpy(dtype='float64')
+    duration = sessions['session_duration_sec'].to_numpy(dtype='float64')
+    timed = ~np.isnan(launch) & ~np.isnan(duration)
+    if not timed.any():
+        return
+
+    # A whole day for every day a session spans, less the part of its first
+    # day before the launch and the part of its last day after the end.
+    # Negative durations are booked as is on the launch day.
+    start, duration = launch[timed], duration[timed]
+    end = start + np.maximum(duration, 0)
+    start_day = np.floor(start / SECONDS_PER_DAY).astype(np.int64)
+    end_day = np.floor(end / SECONDS_PER_DAY).astype(np.int64)
+
+    base = int(start_day.min())
+    n_days = int(end_day.max()) - base + 1
+    head = start_day * SECONDS_PER_DAY - start + np.minimum(duration, 0)
+    tail = end - (end_day + 1) * SECONDS_PER_DAY
+
+    weights = {'': np.ones(len(start))}
+    for key, col in PEAK_WEIGHT_COLUMNS.items():
+        weights[key + '_'] = sessions[col].to_numpy(dtype='float64')[timed] if col in sessions.columns \
+            else np.zeros(len(start))
+
+    chunk_seconds = {}
+    for prefix, weight in weights.items():
+        weight = np.nan_to_num(weight)
+        chunk_seconds[prefix + 'full'] = day_interval_deltas(start_day - base, end_day - base, n_days,
+                                                             weight * SECONDS_PER_DAY)
+        trim = np.bincount(start_day - base, weights=weight * head, minlength=n_days + 1)
+        trim += np.bincount(end_day - base, weights=weight * tail, minlength=n_days + 1)
+        chunk_seconds[prefix + 'trim'] = trim
+
+    chunk_seconds = pd.DataFrame(chunk_seconds, index=np.arange(base, base + n_days + 1))
+    totals['day_seconds'] = totals['day_seconds'].add(chunk_seconds, fill_value=0)
+    totals['use_first_day'] = np.fmin(totals['use_first_day'], base)
+    totals['use_last_day'] = np.fmax(totals['use_last_day'], base + n_days - 1)
+    totals['span_days'] = max(totals['span_days'], int((end_day - start_day).max()))
+
+def update_slot_deltas(totals: dict, finished: pd.DataFrame):
+    """Folds the +1/-1 (or +cpus/-cpus) launch and end events of finished sessions into the totals"""
+    finished = finished[finished['session_end_unix'] >= finished['session_launch_unix']]
+    launch = finished['session_launch_unix'].to_numpy(dtype='float64')
+    end = finished['session_end_unix'].to_numpy(dtype='float64')
+
+    # A session holds every slot it touches, from its launch slot up to the slot its end falls in
+    slots = np.r_[np.floor(launch / CONCURRENCY_SLOT_SEC), np.ceil(end / CONCURRENCY_SLOT_SEC)].astype(np.int64)
+    events = {'sessions': np.r_[np.ones(len(finished)), -np.ones(len(finished))]}
+    for key, col in PEAK_WEIGHT_COLUMNS.items():
+        weights = finished[col].fillna(0).to_numpy(dtype='float64') if col in finished.columns \
+            else np.zeros(len(finished))
+        events[key] = np.r_[weights, -weights]
+
+    chunk_deltas = pd.DataFrame(events, index=slots).groupby(level=0).sum()
+    totals['slot_deltas'] = totals['slot_deltas'].add(chunk_deltas, fill_value=0)
+
+def day_interval_deltas(start: np.ndarray, end: np.ndarray, n_days: int, weights=None):
+    """Returns the difference array of weights over inclusive [start, end] day offsets"""
+    diff = np.bincount(start, weights=weights, minlength=n_days + 1).astype('float64')
+    diff -= np.bincount(end + 1, weights=weights, minlength=n_days + 1)
+    return diff
+
+#
+# Peak concurrency: unlike the day counters above, which count every
+# session that touched a day, this is the largest number of sessions (CPUs,
+# GPUs) running at the same moment. Launches and ends are +1/-1 events
+# bucketed into CONCURRENCY_SLOT_SEC slots; sorting the slots once and
+# taking a cumulative sum gives the level after every event, O(n log n).
+# The max per hour is the max of the levels reached in the hour and the
+# level it starts with. CONCURRENCY_SLOT_SEC must divide an hour.
+#
+CONCURRENCY_SLOT_SEC = 60
+CONCURRENCY_HOURLY_DAYS = 62
+CONCURRENCY_COLUMNS = ['Period', 'Max Concurrent Sessions', 'Max Concurrent CPUs', 'Max Concurrent GPUs']
+CONCURRENCY_FIELDS = ['period', 'max_concurrent_sessions', 'max_concurrent_cpus', 'max_concurrent_gpus']
+
+def hourly_concurrency(slot_deltas: pd.DataFrame, first_day: int, n_days: int):
+    """Returns the max concurrent sessions, CPUs and GPUs of each hour of the days [first_day, first_day + n_days)"""
+    n_hours = n_days * 24
+    # No finished sessions, nothing ever ran concurrently
+    if slot_deltas.empty:
+        return {key: np.zeros(n_hours) for key in slot_deltas.columns}
+
+    levels = slot_deltas.sort_index().cumsum()
+    slots = levels.index.to_numpy(np.int64)
+    hours = slots * CONCURRENCY_SLOT_SEC // 3600 - first_day * 24
+    hour_numbers = np.arange(n_hours)
+
+    in_range = (hours >= 0) & (hours < n_hours)
+    reached = levels[in_range].groupby(hours[in_range]).max().reindex(hour_numbers)
+
+    # Level in the first slot of each hour, left by the last event at or before it
+    hour_slots = (first_day * 24 + hour_numbers) * (3600 // CONCURRENCY_SLOT_SEC)
+    before = np.searchsorted(slots, hour_slots, side='right') - 1
+    concurrency = {}
+    for key in levels.columns:
+        carried = np.where(before >= 0, levels[key].to_numpy()[np.maximum(before, 0)], 0)
+        concurrency[key] = np.fmax(reached[key].to_numpy(), carried)
+    return concurrency
+
+#
+# Daily rollup: upload materializes the usage totals of a whole report
+# into a fact table with one row per day: sessions, CPUs and GPUs active,
+# seconds (and CPU and GPU-seconds) of use clipped to the day, first
+# launch and last end, and the ids of the users and versions active that
+# day (CSR style, ptr[d]:ptr[d + 1]). Peak concurrency is kept one row per
+# hour. A timeline is a window of days, and its peak table and summary are
+# a slice of the rollup and a few reductions over it, O(days) not
+# O(sessions).
+#
+def build_daily_rollup(totals: dict):
+    """Materializes the per-day fact table of a report from its usage totals"""
+    first_day = np.fmin(totals['first_day'], totals['use_first_day'])
+    last_day = np.fmax(totals['last_day'], totals['use_last_day'])
+    base = 0 if np.isnan(first_day) else int(first_day)
+    n_days = 0 if np.isnan(first_day) else int(last_day) - base + 1
+    day_numbers = np.arange(base, base + n_days)
+
+    counts = totals['day_deltas'].reindex(day_numbers, fill_value=0).cumsum()
+    seconds = totals['day_seconds'].reindex(day_numbers, fill_value=0)
+    extremes = totals['day_extremes'].reindex(day_numbers)
+
+    concurrency = hourly_concurrency(totals['slot_deltas'], base, n_days)
+    min_launch = extremes['min_launch'].to_numpy(dtype='float64')
+    max_end = extremes['max_end'].to_numpy(dtype='float64')
+
+    return add_distinct_sketches(typed_rollup({
+        'first_day': base,
+        'n_days': n_days,
+        'peak_days': rollup_peak_days(min_launch, max_end),
+        'sessions': counts['sessions'].to_numpy(),
+        'cpus': counts['cpus'].to_numpy(),
+        'gpus': counts['gpus'].to_numpy(),
+        'concurrency': concurrency,
+        'seconds': seconds['full'].cumsum().to_numpy() + seconds['trim'].to_numpy(),
+        'weighted_seconds': {key: seconds[key + '_full'].cumsum().to_numpy() + seconds[key + '_trim'].to_numpy()
+                             for key in PEAK_WEIGHT_COLUMNS},
+        'min_launch': min_launch,
+        'max_end': max_end,
+        'users': day_name_ids(totals['user_intervals'], 'username', base, n_days),
+        'versions': day_name_ids(totals['version_intervals'], 'version', base, n_days),
+        'duration_is_float': totals['duration_is_float'],
+        'has_username': totals['has_username'],
+        'float_weights': set(totals['float_weights']),
+        'span_days': totals['span_days'],
+    }))
+
+def typed_rollup(rollup: dict):
+    """Rounds the session, CPU and GPU counts of a rollup to integers, unless the report has fractional ones"""
+    def day_counts(key: str, values: np.ndarray):
+        return values if key in rollup['float_weights'] else values.round().astype(np.int64)
+
+    for key in ['sessions', 'cpus', 'gpus']:
+        rollup[key] = day_counts(key, rollup[key])
+    rollup['concurrency'] = {key: day_counts(key, values) for key, values in rollup['concurrency'].items()}
+    return rollup
+
+def rollup_peak_days(min_launch: np.ndarray, max_end: np.ndarray):
+    """Returns the [a, b) offsets of the reported days, from the first finished launch to the last finished end"""
+    launched = np.flatnonzero(~np.isnan(min_launch))
+    ended = np.flatnonzero(~np.isnan(max_end))
+    if len(launched) == 0 or len(ended) == 0:
+        return 0, 0
+    return int(launched[0]), int(ended[-1]) + 1
+
+def day_name_ids(intervals: pd.DataFrame, col: str, base: int, n_days: int):
+    """Expands merged name intervals into (ptr, ids, names): the names active on day d are names[ids[ptr[d]:ptr[d + 1]]]"""
+    codes, names = pd.factorize(intervals[col])
+    start = intervals['start'].to_numpy(np.int64) - base
+    lengths = intervals['end'].to_numpy(np.int64) - base - start + 1
+
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    days = np.repeat(start, lengths) + np.arange(lengths.sum()) - offsets
+    order = np.argsort(days, kind='stable')
+
+    ptr = np.r_[0, np.cumsum(np.bincount(days, minlength=n_days))]
+    return ptr, np.repeat(codes, lengths)[order].astype(np.int32), names.to_numpy()
+
+#
+# Distinct sketches: distinct counts of days cannot be summed, so next to
+# its users and versions a rollup keeps one mergeable sketch per day. Any
+# range of days is then counted by merging O(days) sketches rather than
+# the (day, name) pairs of the range. A sketch is an exact bitmap of name
+# ids while that is no larger than a HyperLogLog of HLL_PRECISION bits,
+# whose standard error is shown with the estimate.
+# STEAM_STATS_DISTINCT_SKETCH set to exact or hll picks one kind for every
+# report.
+#
+DISTINCT_SKETCH = os.environ.get('STEAM_STATS_DISTINCT_SKETCH', 'auto')
+HLL_PRECISION = 12
+HLL_REGISTERS = 2 ** HLL_PRECISION
+
+def add_distinct_sketches(rollup: dict):
+    """Adds the per-day distinct sketches of the users and versions of a rollup"""
+    rollup['sketches'] = {key: distinct_sketch(rollup[key], rollup['n_days']) for key in ['users', 'versions']}
+    return rollup
+
+def distinct_sketch(name_ids: tuple, n_days: int):
+    """Returns the per-day sketch of (ptr, ids, names): exact bitmaps of name ids, or HyperLogLog registers"""
+    ptr, ids, names = name_ids
+    days = np.repeat(np.arange(n_days), np.diff(ptr))
+    exact = DISTINCT_SKETCH == 'exact' or (DISTINCT_SKETCH != 'hll' and len(names) <= 8 * HLL_REGISTERS)
+
+    if exact:
+        bits = np.zeros((n_days, (len(names) + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(bits, (days, ids >> 3), (1 << (ids & 7)).astype(np.uint8))
+        return {'kind': 'exact', 'days': bits}
+
+    register, rank = hll_register_ranks(names)
+    registers = np.zeros((n_days, HLL_REGISTERS), dtype=np.uint8)
+    np.maximum.at(registers, (days, register[ids]), rank[ids])
+    return {'kind': 'hll', 'days': registers}
+
+def hll_register_ranks(names: np.ndarray):
+    """Returns the HyperLogLog register of each name and the rank (leading zeros + 1) of the rest of its hash"""
+    hashes = pd.util.hash_array(names.astype(object))
+    register = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+
+    # Remaining bits, with a stop bit so that there is always one set
+    rest = (hashes << np.uint64(HLL_PRECISION)) | np.uint64(1 << (HLL_PRECISION - 1))
+    return register, (65 - bit_lengths(rest)).astype(np.uint8)
+
+def bit_lengths(values: np.ndarray):
+    """Returns the number of bits each of non-negative 64-bit integers takes"""
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in [32, 16, 8, 4, 2, 1]:
+        high = values >> values.dtype.type(shift) != 0
+        lengths += np.where(high, shift, 0)
+        values = np.where(high, values >> values.dtype.type(shift), values)
+    return lengths + (values != 0)
+
+def sketch_distinct(sketch: dict, a: int, b: int):
+    """Returns the distinct names of the days in [a, b) of a sketch and the relative standard error of the count"""
+    if a >= b:
+        return 0, 0.0
+    if sketch['kind'] == 'exact':
+        return int(np.unpackbits(np.bitwise_or.reduce(sketch['days'][a:b], axis=0)).sum()), 0.0
+
+    registers = sketch['days'][a:b].max(axis=0)
+    alpha = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+    estimate = alpha * HLL_REGISTERS ** 2 / np.sum(2.0 ** -registers.astype(np.float64))
+    zeros = int((registers == 0).sum())
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        estimate = HLL_REGISTERS * np.log(HLL_REGISTERS / zeros)
+    return int(round(estimate)), 1.04 / np.sqrt(HLL_REGISTERS)
+
+def rollup_window(rollup: dict, meta: dict, x_filter: str):
+    """Returns the [a, b) day offsets of a timeline in the daily rollup"""
+    n_days = rollup['n_days']
+    if x_filter == 'All':
+        return 0, n_days
+    if meta['n_valid'] == 0:
+        return 0, 0
+
+    def day_offset(ts: pd.Timestamp):
+        day = ts.value // (SECONDS_PER_DAY * 10**9)
+        return int(min(max(day - rollup['first_day'], 0), n_days))
+
+    start, end = timeline_window(meta['first'], meta['latest'], x_filter)
+    a = 0 if start is None else day_offset(start)
+    b = n_days if end is None else day_offset(end)
+    return a, max(a, b)
+
+def rollup_peak_usage(rollup: dict, a: int, b: int):
+    """Returns Peak Sessions, CPUs, GPUs and Unique Users for the reported days in [a, b)"""
+    a, b = max(a, rollup['peak_days'][0]), min(b, rollup['peak_days'][1])
+    if a >= b:
+        return pd.DataFrame(columns=PEAK_USAGE_COLUMNS)
+
+    days = pd.date_range(start=pd.Timestamp((rollup['first_day'] + a) * SECONDS_PER_DAY, unit='s'),
+                         periods=b - a, freq='D')
+    concurrency = {key: values.reshape(-1, 24)[a:b].max(axis=1) for key, values in rollup['concurrency'].items()}
+    return pd.DataFrame({
+        'Day Present': days.strftime('%Y-%m-%d'),
+        'Peak Sessions': rollup['sessions'][a:b],
+        'Peak CPUs': rollup['cpus'][a:b],
+        'Peak GPUs': rollup['gpus'][a:b],
+        'Unique Users': np.diff(rollup['users'][0][a:b + 1]),
+        'Max Concurrent Sessions': concurrency['sessions'],
+        'Max Concurrent CPUs': concurrency['cpus'],
+        'Max Concurrent GPUs': concurrency['gpus'],
+    }, columns=PEAK_USAGE_COLUMNS)
+
+def rollup_concurrency(rollup: dict, a: int, b: int):
+    """Returns the max concurrent sessions, CPUs and GPUs of the reported days in [a, b), hourly for short windows"""
+    a, b = max(a, rollup['peak_days'][0]), min(b, rollup['peak_days'][1])
+    if a >= b:
+        return pd.DataFrame(columns=CONCURRENCY_COLUMNS)
+
+    if b - a <= CONCURRENCY_HOURLY_DAYS:
+        periods = (b - a) * 24
+        concurrency = {key: values[a * 24:b * 24] for key, values in rollup['concurrency'].items()}
+        freq, period_format = 'h', '%Y-%m-%d %H:00'
     else:
-            users = "N/A"
-            versions = "N/A"
-            
-    #
-    # Steps to get to peak users and other peak aggs
-    #
-    qq = """
-                    select *, datetime(session_launch_unix,'unixepoch') as start_ts, 
-                                      datetime(session_end_unix,'unixepoch') as end_ts 
-                    from sessions
-                    where session_state='finished'
-            """
-    v_basetable = psql.sqldf(qq,locals())
+        periods = b - a
+        concurrency = {key: values.reshape(-1, 24)[a:b].max(axis=1) for key, values in rollup['concurrency'].items()}
+        freq, period_format = 'D', '%Y-%m-%d'
+
+    start = pd.Timestamp((rollup['first_day'] + a) * SECONDS_PER_DAY, unit='s')
+    return pd.DataFrame({
+        'Period': pd.date_range(start=start, periods=periods, freq=freq).strftime(period_format),
+        'Max Concurrent Sessions': concurrency['sessions'],
+        'Max Concurrent CPUs': concurrency['cpus'],
+        'Max Concurrent GPUs': concurrency['gpus'],
+    }, columns=CONCURRENCY_COLUMNS)
+
+def rollup_summary(rollup: dict, a: int, b: int, n_rows: int):
+    """Returns the summary KPIs of the days in [a, b): hours, first launch, last end, users and versions of
+    the activity on those days, n_rows being the sessions launched in them"""
+    def unix_to_text(values: np.ndarray, reduce):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return "N/A"
+        return pd.Timestamp(int(np.floor(reduce(values))), unit='s').strftime("%c")
+
+    def n_distinct(key: str):
+        if not rollup['has_username']:
+            return "N/A"
+        count, error = sketch_distinct(rollup['sketches'][key], a, b)
+        return count if not error else '{0} (± {1:.1%})'.format(count, error)
+
+    seconds = rollup['seconds'][a:b]
+    if n_rows == 0 and not seconds.any():
+        hours = None
+    elif rollup['duration_is_float']:
+        hours = seconds.sum() / 3600
+    else:
+        hours = int(round(seconds.sum())) // 3600
 
-    qq = """
-                    select date(min_ts) as minval,
-                               date(max_ts) as maxval
-                            from min_max_ts
-            """
-    min_max = psql.sqldf(qq,locals())
+    return {
+        'n_rows': n_rows,
+        'hours': hours,
+        'min_ts': unix_to_text(rollup['min_launch'][a:b], np.min),
+        'max_ts': unix_to_text(rollup['max_end'][a:b], np.max),
+        'unique_users': n_distinct('users'),
+        'unique_versions': n_distinct('versions'),
+    }
 
-    rx = pd.date_range(start=min_max['minval'].values[0], end=min_max['maxval'].values[0], freq='D')
-    range_values = pd.DataFrame(rx)
-    range_values.columns = ['day_present']
+#
+# Rolling usage: for license sizing, the distinct users and the CPU and
+# GPU-hours of the last 7, 30 and 90 days, as of every day. Hours are a
+# difference of cumulative sums. For users, each (day, user) pair of the
+# rollup stays the user's last-seen day until the next day they are seen,
+# and counts towards the windows ending on those days, up to the window
+# length. One sort of the pairs by user finds the next day, and a
+# difference array per window sums them up, O(days + pairs) per window
+# whatever its length.
+#
+ROLLING_WINDOWS = [7, 30, 90]
+ROLLING_WEIGHTS = {'cpus': 'cpu_hours', 'gpus': 'gpu_hours'}
+ROLLING_USAGE_FIELDS = ['day'] + ['{0}_{1}d'.format(field, window) for field in ['users'] + list(ROLLING_WEIGHTS.values())
+                                  for window in ROLLING_WINDOWS]
+
+def rollup_next_seen(rollup: dict):
+    """Returns the day offset of each (day, user) pair of a rollup and the next day its user is seen, n_days if never"""
+    ptr, ids, _ = rollup['users']
+    days = np.repeat(np.arange(rollup['n_days']), np.diff(ptr))
+    order = np.argsort(ids, kind='stable')
+    repeated = ids[order][1:] == ids[order][:-1]
+    next_seen = np.full(len(ids), rollup['n_days'], dtype=np.int64)
+    next_seen[order[:-1][repeated]] = days[order][1:][repeated]
+    return days, next_seen
+
+def rollup_rolling_usage(rollup: dict, a: int, b: int):
+    """Returns the rolling unique users and CPU and GPU-hours of each reported day in [a, b)"""
+    a, b = max(a, rollup['peak_days'][0]), min(b, rollup['peak_days'][1])
+    if a >= b:
+        return pd.DataFrame(columns=ROLLING_USAGE_FIELDS)
+
+    n_days = rollup['n_days']
+    days, next_seen = rollup_next_seen(rollup)
+    hours = {key: np.r_[0, np.cumsum(values)] / 3600 for key, values in rollup['weighted_seconds'].items()}
+
+    rolling = {'day': pd.date_range(start=pd.Timestamp((rollup['first_day'] + a) * SECONDS_PER_DAY, unit='s'),
+                                    periods=b - a, freq='D').strftime('%Y-%m-%d')}
+    for window in ROLLING_WINDOWS:
+        if rollup['has_username']:
+            until = np.minimum(next_seen, days + window)
+            users = np.cumsum(np.bincount(days, minlength=n_days + 1) - np.bincount(until, minlength=n_days + 1))
+            rolling['users_{0}d'.format(window)] = users[a:b]
+        else:
+            rolling['users_{0}d'.format(window)] = np.nan
+        ends = np.arange(a, b) + 1
+        for key, field in ROLLING_WEIGHTS.items():
+            rolling['{0}_{1}d'.format(field, window)] = (hours[key][ends] - hours[key][np.maximum(ends - window, 0)]).round(2)
+    return pd.DataFrame(rolling, columns=ROLLING_USAGE_FIELDS)
 
-    qq = """
-                    select *
-                            from
-                            (select * from v_basetable) a
-                                    inner join range_values b
-                            on 
-                                    (date(a.start_ts) <= date(b.day_present) 
-                                    and
-                                     date(a.end_ts) >= date(b.day_present))
-            """
-    base_table_expanded = psql.sqldf(qq,locals())
+#
+# Appending reports: a re-exported report is merged into the current one,
+# new rows replacing old ones with the same identity columns. The merged
+# report is written out as a csv like any upload. Only the days touched
+# by replaced or new sessions are rolled up again, from the sessions
+# launched close enough to reach them, and spliced into the old rollup.
+# A merged report superseded by the next append is removed, along with
+# its analytics store and session store entry.
+#
+SESSION_IDENTITY_COLUMNS = ['id']
+SESSION_FALLBACK_IDENTITY_COLUMNS = ['username', 'version', 'session_launch_unix']
+APPEND_MARGIN_DAYS = 2
+
+merged_reports = set()
+
+def session_identity_columns(columns: list):
+    """Returns the columns that identify a session across exports of the report"""
+    if all(col in columns for col in SESSION_IDENTITY_COLUMNS):
+        return SESSION_IDENTITY_COLUMNS
+    return [col for col in SESSION_FALLBACK_IDENTITY_COLUMNS if col in columns]
+
+def merged_report_path(file_path: str, new_path: str):
+    """Names the merged report after the original report and the appended one, next to the original
+    and compressed like the appended one"""
+    stem = os.path.splitext(report_csv_name(file_path))[0].split('+')[0]
+    return os.path.join(os.path.dirname(file_path), stem + '+' + os.path.basename(new_path))
+
+def append_report(file_path: str, new_path: str, job: dict = None):
+    """Merges a new report into a report, returning the path of the merged report"""
+    entry = open_dataset(file_path, job)
+
+    report_progress(job, 'Parsing new sessions')
+    added = read_sessions_csv(new_path)
+    identity = session_identity_columns(added.columns)
+    added = added.drop_duplicates(identity, keep='last')
+    added_keys = pd.MultiIndex.from_frame(added[identity])
+
+    # Old sessions first, in their order, then the new ones
+    merged_path = merged_report_path(file_path, new_path)
+    tmp_path = merged_path + '.tmp'
+    removed = []
+    with create_report(tmp_path, report_compression(merged_path), report_csv_name(merged_path)) as f:
+        columns = None
+        for chunk in session_chunks(entry):
+            report_progress(job, 'Merging sessions')
+            replaced = pd.MultiIndex.from_frame(chunk[identity]).isin(added_keys)
+            if replaced.any():
+                removed.append(chunk[replaced])
+            chunk[~replaced].to_csv(f, header=columns is None, index=False)
+            columns = chunk.columns
+        added.reindex(columns=columns).to_csv(f, header=False, index=False)
+    os.replace(tmp_path, merged_path)
+
+    removed = pd.concat(removed) if removed else added.iloc[0:0]
+    open_dataset(merged_path, job, lambda merged, job: append_rollup(entry['rollup'], merged, removed, added, job))
+    merged_reports.add(merged_path)
+
+    # Earlier merges are only kept until they are merged again
+    if file_path in merged_reports:
+        discard_report(None if file_path == merged_path else file_path, entry)
+    return merged_path
+
+def discard_report(file_path: str, entry: dict):
+    """Removes a superseded report (file and session store entry, unless it was replaced in place)
+    and its analytics store, unless another report shares it"""
+    paths = []
+    if file_path is not None:
+        merged_reports.discard(file_path)
+        forget_dataset(file_path)
+        paths.append(file_path)
+    with session_store_lock:
+        if not any(x['db_path'] == entry['db_path'] for x in session_store.values()):
+            paths.append(entry['db_path'])
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def touched_days(sessions: pd.DataFrame):
+    """Returns the day numbers whose rollup a set of sessions can contribute to, in no order"""
+    launch = sessions['session_launch_unix'].to_numpy(dtype='float64')
+    end = sessions['session_end_unix'].to_numpy(dtype='float64')
+    days = [np.floor(launch / SECONDS_PER_DAY), np.floor(end / SECONDS_PER_DAY) + 1]
+    if 'session_duration_sec' in sessions.columns:
+        duration = sessions['session_duration_sec'].to_numpy(dtype='float64')
+        days.append(np.floor((launch + np.maximum(duration, 0)) / SECONDS_PER_DAY))
+    days = np.concatenate(days)
+    return days[~np.isnan(days)].astype(np.int64)
+
+def append_rollup(rollup: dict, entry: dict, removed: pd.DataFrame, added: pd.DataFrame, job: dict = None):
+    """Returns the rollup of a merged report from the rollup before the merge and the sessions it replaced and added"""
+    days = touched_days(pd.concat([removed, added]))
+    if len(days) == 0:
+        return rollup
+    lo, hi = int(days.min()), int(days.max())
+
+    # Any session that reaches [lo, hi] was launched at most span days away from it
+    span = max(rollup['span_days'], update_usage_totals(new_usage_totals(), added)['span_days'])
+    span += APPEND_MARGIN_DAYS
+    position = dataset_launch_position(entry)
+    row_ranges = [(position(pd.Timestamp((lo - span) * SECONDS_PER_DAY, unit='s')),
+                   position(pd.Timestamp((hi + span + 1) * SECONDS_PER_DAY, unit='s'))),
+                  (entry['meta']['n_valid'], entry['meta']['n_rows'])]
+    part = build_daily_rollup(report_usage_totals(entry, job, row_ranges))
+
+    # Fractional counts are only known for the whole report when it is held in memory
+    if entry['sessions'] is None:
+        part['float_weights'] |= rollup['float_weights']
+        part['duration_is_float'] |= rollup['duration_is_float']
+        part['has_username'] |= rollup['has_username']
+    return splice_rollup(rollup, part, lo, hi)
+
+def splice_rollup(rollup: dict, part: dict, lo: int, hi: int):
+    """Returns a rollup with the days lo..hi (day numbers) taken from part and the others from rollup"""
+    base = min(rollup['first_day'], lo) if rollup['n_days'] else lo
+    end = max(rollup['first_day'] + rollup['n_days'], hi + 1) if rollup['n_days'] else hi + 1
+    n_days = end - base
+
+    def splice(old: np.ndarray, new: np.ndarray, fill: float, per_day: int = 1):
+        out = np.full(n_days * per_day, fill, dtype='float64')
+        if len(old):
+            offset = (rollup['first_day'] - base) * per_day
+            out[offset:offset + len(old)] = old
+        out[(lo - base) * per_day:(hi + 1 - base) * per_day] = fill
+        a, b = max(lo, part['first_day']), min(hi + 1, part['first_day'] + part['n_days'])
+        if a < b:
+            out[(a - base) * per_day:(b - base) * per_day] = new[(a - part['first_day']) * per_day:
+                                                                 (b - part['first_day']) * per_day]
+        return out
+
+    def splice_names(old: tuple, new: tuple):
+        # Day, name pairs of both sides, in the old rollup's name ids plus the new names
+        names = pd.Index(old[2]).append(pd.Index(new[2]).difference(pd.Index(old[2]), sort=False))
+        old_days = np.repeat(np.arange(len(old[0]) - 1), np.diff(old[0])) + rollup['first_day']
+        new_days = np.repeat(np.arange(len(new[0]) - 1), np.diff(new[0])) + part['first_day']
+        keep_old = (old_days < lo) | (old_days > hi)
+        keep_new = (new_days >= lo) & (new_days <= hi)
+        days = np.r_[old_days[keep_old], new_days[keep_new]] - base
+        ids = np.r_[old[1][keep_old], names.get_indexer(new[2][new[1][keep_new]])]
+
+        order = np.argsort(days, kind='stable')
+        ptr = np.r_[0, np.cumsum(np.bincount(days, minlength=n_days))]
+        return ptr, ids[order].astype(np.int32), names.to_numpy()
+
+    min_launch = splice(rollup['min_launch'], part['min_launch'], np.nan)
+    max_end = splice(rollup['max_end'], part['max_end'], np.nan)
+    return add_distinct_sketches(typed_rollup({
+        'first_day': base,
+        'n_days': n_days,
+        'peak_days': rollup_peak_days(min_launch, max_end),
+        'sessions': splice(rollup['sessions'], part['sessions'], 0),
+        'cpus': splice(rollup['cpus'], part['cpus'], 0),
+        'gpus': splice(rollup['gpus'], part['gpus'], 0),
+        'concurrency': {key: splice(values, part['concurrency'][key], 0, 24)
+                        for key, values in rollup['concurrency'].items()},
+        'seconds': splice(rollup['seconds'], part['seconds'], 0),
+        'weighted_seconds': {key: splice(values, part['weighted_seconds'][key], 0)
+                             for key, values in rollup['weighted_seconds'].items()},
+        'min_launch': min_launch,
+        'max_end': max_end,
+        'users': splice_names(rollup['users'], part['users']),
+        'versions': splice_names(rollup['versions'], part['versions']),
+        'duration_is_float': part['duration_is_float'],
+        'has_username': part['has_username'],
+        'float_weights': part['float_weights'],
+        'span_days': max(rollup['span_days'], part['span_days']),
+    }))
+
+def make_ui_processed(results: dict, name: str):
 
-    qq = """
-                    select date(a.day_present) as 'Day Present',
-                            sum(case when b.start_ts is null then 0 else 1 end) as 'Peak Sessions',
-                            sum(case when b.cpu_count is null then 0 else b.cpu_count end) as 'Peak CPUs',
-                            sum(case when b.gpu_count is null then 0 else b.gpu_count end) as 'Peak GPUs',
-                            count(distinct username) as 'Unique Users'
-                    from 
-                            range_values a 
-                                    left join 
-                            base_table_expanded b 
-                                    on (date(a.day_present) = date(b.day_present))
-                    group by 1
-                    order by 1
-            """
-    peak_usage = psql.sqldf(qq,locals())
-    peak_usage.to_csv("data/peak_usage.csv",header=['day_present','peak_sessions','peak_cpus','peak_gpus','unique_users'])
+    #
+    # Peak users and other peak aggs, one row per day in the log range
+    #
+    peak_usage = results['peak_usage']
 
     #
     # Ready to render results 
     #
-    df_render = pd.DataFrame(peak_usage, columns = ['Day Present','Peak Sessions','Peak CPUs','Peak GPUs','Unique Users'])
+    df_render = pd.DataFrame(peak_usage, columns = PEAK_USAGE_COLUMNS)
     n_rows = df_render.shape[0]
 
 
     table = ui.table(
             name=name,
-            columns=[ui.table_column(name=str(x), label=str(x), sortable=True,  data_type= np.where(re.search(r'Peak|Users', x),
-                                               'number', 'string').item()) for x in df_render.columns.values],
-            rows=[ui.table_row(name=str(i), cells=[str(df_render[col].values[i]) for col in df_render.columns.values])
+            columns=[ui.table_column(name=str(x), label=str(x), sortable=True,  data_type= np.where(re.search(r'Peak|Users|Concurrent', x),
+                                               'number', 'string').item(), link=x == 'Day Present') for x in df_render.columns.values],
+            # Clicking a day lists the sessions active on it
+            rows=[ui.table_row(name=str(df_render['Day Present'].values[i]), cells=[str(df_render[col].values[i]) for col in df_render.columns.values])
                       for i in range(n_rows)],
             downloadable=True
     )
 
     return table
 
-def render_charts(q:Q):
-    sessions = pd.read_csv(q.client.working_file_path)
-    sessions = filter_rows_by_timeline(sessions, q.client.timeline)
-
-    peak_usage = pd.read_csv('data/peak_usage.csv')
-    #header=['day_present','peak_sessions','peak_cus','unique_users'])               )
-    
-    spec = altair_area_line_chart(data=peak_usage,
-                                x="day_present:T",
-                                x_title="Day",
-                                y1="peak_sessions:Q",
-                                y1_title="Peak Sessions",
-                                y1_color="brown",
-                                y2="unique_users:Q",
-                                y2_title="Unique Users",
-                                y2_color="blue")
-    
+async def render_charts(q:Q):
+    out = await run_analytics(q, 'view', 'Drawing charts', make_chart_cards, q.client.working_file_path,
+                              q.client.timeline, q.client.usage_results, q.client.active_sessions)
+    if out is None:
+        return
+
+    cards, q.client.usage_results = out
+    for name, card in cards.items():
+        q.page[name] = card
+
+def make_chart_cards(file_path: str, timeline: str, results: dict, active: dict = None, job: dict = None):
+    """Builds the drill down chart cards of a report over a timeline, along with its usage results"""
+    if not usage_results_match(results, file_path, timeline):
+        report_progress(job, 'Rolling up usage by day')
+        results = usage_results(file_path, timeline, job)
+
+    cards = {}
+    report_progress(job, 'Drawing charts')
+    peak_usage = results['peak_usage']
+    peak_usage = peak_usage.rename(columns=dict(zip(PEAK_USAGE_COLUMNS, PEAK_USAGE_FIELDS)))
     
-    q.page['daily_peak_sessions_users'] = ui.vega_card(
-                                                    box='3 2 9 6',
+    spec = chart_spec(file_path, timeline, 'daily_peak_sessions_users', altair_area_line_chart,
+                      lambda: peak_usage,
+                      x="day_present:T",
+                      x_title="Day",
+                      y1="peak_sessions:Q",
+                      y1_title="Peak Sessions",
+                      y1_color="brown",
+                      y2="unique_users:Q",
+                      y2_title="Unique Users",
+                      y2_color="blue")
+
+    cards['daily_peak_sessions_users'] = ui.vega_card(
+                                                    box='3 2 5 6',
                                                     title='Daily Peak Sessions and Unique Users',
                                                     specification=spec,
                                               )
     
+    # Rolling 7, 30 and 90 day users and hours, for license sizing
+    for name, field, title, box in [('rolling_users', 'users', 'Rolling Unique Users', '1 16 4 6'),
+                                    ('rolling_cpu_hours', 'cpu_hours', 'Rolling CPU-Hours', '5 16 4 6'),
+                                    ('rolling_gpu_hours', 'gpu_hours', 'Rolling GPU-Hours', '9 16 3 6')]:
+        windows = {}
+        for i, (window, color) in enumerate(zip(ROLLING_WINDOWS, ROLLING_COLORS)):
+            windows['y{0}'.format(i + 1)] = '{0}_{1}d:Q'.format(field, window)
+            windows['y{0}_title'.format(i + 1)] = '{0} days'.format(window)
+            windows['y{0}_color'.format(i + 1)] = color
+        spec = chart_spec(file_path, timeline, name, altair_multi_line_chart,
+                          lambda: rolling_usage(file_path, timeline),
+                          x="day:T",
+                          x_title="Day",
+                          y_title=title,
+                          **windows)
+        cards[name] = ui.vega_card(box=box, title=title + ' (7, 30 and 90 Days)', specification=spec)
+
+    concurrency = results['concurrency']
+    concurrency = concurrency.rename(columns=dict(zip(CONCURRENCY_COLUMNS, CONCURRENCY_FIELDS)))
+    hourly = len(concurrency) > 0 and ':' in concurrency['period'].iloc[0]
+
+    spec = chart_spec(file_path, timeline, 'peak_concurrency', altair_area_line_chart,
+                      lambda: concurrency,
+                      x="period:T",
+                      x_title="Hour" if hourly else "Day",
+                      y1="max_concurrent_sessions:Q",
+                      y1_title="Max Concurrent Sessions",
+                      y1_color="brown",
+                      y2="max_concurrent_cpus:Q",
+                      y2_title="Max Concurrent CPUs",
+                      y2_color="green")
+
+    cards['peak_concurrency'] = ui.vega_card(
+                                        box='8 2 4 6',
+                                        title='Peak Concurrent Sessions and CPUs',
+                                        specification=spec,
+                                  )
+
     qq = """
            select version as product,count(*) as sessions
            from sessions
@@ -454,9 +2638,10 @@ def render_charts(q:Q):
             order by 2 desc
         """
 
-    product_usage = psql.sqldf(qq,locals())
+    product_usage = cached_result((results['hash'], timeline, 'product_usage'),
+                                  lambda: query_sessions(file_path, timeline, qq))
 
-    q.page['product_usage'] = ui.plot_card(
+    cards['product_usage'] = ui.plot_card(
                         box='3 8 3 -1',
                         title='Version Usage by Sessions',
                         data=data(
@@ -483,25 +2668,75 @@ def render_charts(q:Q):
             limit 15
         """
 
-    user_usage = psql.sqldf(qq, locals())
-
-    spec = altair_area_line_chart(data=user_usage,
-                                x="username:O",
-                                x_title="User",
-                                y1="sessions:Q",
-                                y1_title="Sessions",
-                                y1_color="blue",
-                                y2="hours:Q",
-                                y2_title="Hours",
-                                y2_color="orange")
-
-    
-    q.page['user_usage'] = ui.vega_card(
+    spec = chart_spec(file_path, timeline, 'user_usage', altair_area_line_chart,
+                      lambda: query_sessions(file_path, timeline, qq),
+                      x="username:O",
+                      x_title="User",
+                      y1="sessions:Q",
+                      y1_title="Sessions",
+                      y1_color="blue",
+                      y2="hours:Q",
+                      y2_title="Hours",
+                      y2_color="orange")
+
+    cards['user_usage'] = ui.vega_card(
                                 box='6 8 6 -1',
                                 title='Top 15 Power Users by Sessions/Hours',
                                 specification=spec,
                             )
-    
+
+    # The peak of a chart is looked up by picking its day or hour
+    cards['active_sessions'] = make_active_sessions_card(file_path, active, job)
+
+    return cards, results
+
+#
+# Chart specs: drawn once per report, timeline and chart, and kept in the
+# result cache. Time series longer than the point budget
+# are bucketed to the finest grain that fits, keeping each bucket's max
+# so peaks survive.
+#
+CHART_POINT_BUDGET = 500
+ROLLING_COLORS = ['orange', 'blue', 'purple']
+CHART_BUCKETS = [('h', 'Hour'), ('3h', '3 Hours'), ('6h', '6 Hours'), ('12h', '12 Hours'),
+                 ('D', 'Day'), ('W', 'Week'), ('M', 'Month'), ('Q', 'Quarter'), ('Y', 'Year')]
+
+def chart_spec(file_path: str, timeline: str, chart: str, draw, get_data, x: str, x_title: str, **encoding):
+    """Returns the cached Vega spec of a chart of a report over a timeline, drawn with get_data() on a miss"""
+    def draw_spec(x_title):
+        # Only the plotted fields are inlined into the spec
+        fields = [x] + [value for key, value in encoding.items() if re.fullmatch(r'y\d', key)]
+        data = get_data()[[field.split(':')[0] for field in fields]]
+        with diagnostics_stage('draw ' + chart, rows_in=len(data)) as stage:
+            if x.endswith(':T'):
+                data, x_title = downsample_series(data, x[:-2], x_title)
+            stage['rows_out'] = len(data)
+            return draw(data=data, x=x, x_title=x_title, **encoding)
+
+    return cached_result((open_dataset(file_path)['hash'], timeline, 'chart', chart), lambda: draw_spec(x_title))
+
+def bucket_starts(dates: pd.Series, freq: str):
+    """Returns the start of the bucket each date falls in"""
+    if freq[-1] in 'hD':
+        return dates.dt.floor(freq)
+    return dates.dt.to_period(freq).dt.start_time
+
+def downsample_series(data: pd.DataFrame, x: str, x_title: str, budget: int = CHART_POINT_BUDGET):
+    """Buckets a time series to the finest grain with at most budget points, returning it with its x title"""
+    if len(data) <= budget:
+        return data, x_title
+
+    dates = pd.to_datetime(data[x])
+    for freq, title in CHART_BUCKETS:
+        starts = bucket_starts(dates, freq)
+        if starts.nunique() <= budget:
+            break
+
+    date_format = '%Y-%m-%d %H:00' if freq[-1] == 'h' else '%Y-%m-%d'
+    buckets = data.drop(columns=x).groupby(starts.to_numpy(), sort=True).max()
+    buckets.insert(0, x, buckets.index.strftime(date_format))
+    return buckets.reset_index(drop=True), title
+
 def altair_bar_line_chart(data: pd, x: str, x_title: str, y1:str, y1_title:str, y1_color:str, y2:str, y2_title: str,y2_color: str):
     
     base = alt.Chart(data,title = "").encode(
@@ -521,6 +2756,24 @@ def altair_bar_line_chart(data: pd, x: str, x_title: str, y1:str, y1_title:str,
     spec = alt.layer(bar_A, line_B).resolve_scale(y='independent').to_json()
     return spec   
 
+def altair_multi_line_chart(data: pd, x: str, x_title: str, y_title: str, **lines):
+    """Draws the y1, y2, ... fields as lines on a shared axis, colored by their y1_title, ... in the legend"""
+    series = sorted(key for key in lines if re.fullmatch(r'y\d', key))
+    fields = [lines[key].split(':')[0] for key in series]
+    titles = [lines[key + '_title'] for key in series]
+    colors = [lines[key + '_color'] for key in series]
+
+    chart = alt.Chart(data.rename(columns=dict(zip(fields, titles))), title="").transform_fold(
+            titles, as_=['series', 'value']
+    ).mark_line().encode(
+            alt.X(x, title=x_title),
+            alt.Y('value:Q', title=y_title),
+            alt.Color('series:N', title=None, sort=titles, scale=alt.Scale(domain=titles, range=colors)),
+            tooltip=[x, 'series:N', 'value:Q']
+    ).properties(width='container', height='container')
+
+    return chart.to_json()
+
 def altair_area_line_chart(data: pd, x: str, x_title: str, y1:str, y1_title:str, y1_color:str, y2:str, y2_title: str,y2_color: str):
     
     base = alt.Chart(data,title = "").encode(
@@ -540,75 +2793,246 @@ def altair_area_line_chart(data: pd, x: str, x_title: str, y1:str, y1_title:str,
     spec = alt.layer(area_A, line_B).resolve_scale(y='independent').to_json()
     return spec   
      
-def filter_rows_by_timeline(df: pd, x_filter: str):
- 
-#     ui.choice('All','All'),
-#     ui.choice('First 30 days','First 30 days'),
-#     ui.choice('Recent 30 days','Recent 30 days'),
-#     ui.choice('Recent 60 days','Recent 60 days'),
-#     ui.choice('Recent month','Recent month'),
-#     ui.choice('Prev month','Prev month'),
-#     ui.choice('Recent year','Recent year'),
-#     ui.choice('Prev year','Prev year')
- 
-
-   # Create markers for filtering
-   qq = """ select 
-             max(date(session_launch_date)) as latest_day, 
-              min(date(session_launch_date,'+30 days')) as first_30_days,
-              max(date(session_launch_date, 'start of year')) as latest_year_start,
-              max(date(session_launch_date, 'start of year','-1 year')) as prev_year_start,
-                            
-              max(date(session_launch_date, 'start of month')) as latest_month_start,
-              max(date(session_launch_date, 'start of month','-1 month')) as prev_month_start,
-              
-              max(strftime('%Y', session_launch_date)) as current_year,
-              max(strftime('%W', session_launch_date)) as current_week,
-              max(date(session_launch_date,'-30 days')) as recent_30_days,
-              max(date(session_launch_date,'-60 days')) as recent_60_days
-
-         from df
-      """
-
-   markers = psql.sqldf(qq,locals()) 
-
-   # Fallback
-   df2 = df
-
-   if (x_filter == 'First 30 days'):
-       # First 30 days
-       qq = "select a.* from df a join markers b where a.session_launch_date <=  first_30_days"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Recent 30 days'):
-       # Recent 30 days
-       qq = "select a.* from df a join markers b where a.session_launch_date >=  recent_30_days"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Recent 60 days'):
-       # Recent 60 days
-       qq = "select a.* from df a join markers b where a.session_launch_date >=  recent_60_days"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Recent month'):
-       # Recent month
-       qq = "select a.* from df a join markers b where a.session_launch_date >= latest_month_start"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Prev month'):
-       # Prev month
-       qq = "select a.* from df a join markers b where a.session_launch_date >= b.prev_month_start and a.session_launch_date < b.latest_month_start"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Recent year'):
-       # Recent year
-       qq = "select a.* from df a join markers b where a.session_launch_date >= b.latest_year_start"
-       df2 = psql.sqldf(qq,locals())
-
-   if (x_filter == 'Prev year'):
-       # Prev year
-       qq = "select a.* from df a join markers b where a.session_launch_date >= b.prev_year_start and a.session_launch_date < b.latest_year_start"
-       df2 = psql.sqldf(qq,locals())
-
-   return df2
+#
+# Timeline filtering: sessions in the store are sorted by launch date, so
+# every preset (and any custom date range) resolves to a [start, end)
+# window whose rows are found by binary search and returned as a slice
+#
+TIMELINE_CHOICES = ['All', 'First 30 days', 'Recent 30 days', 'Recent 60 days',
+                    'Recent month', 'Prev month', 'Recent year', 'Prev year']
+CUSTOM_TIMELINE = 'Custom range'
+
+def custom_timeline(start_date: str, end_date: str):
+    """Encodes a custom date range as a timeline value"""
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    return start_date + ' to ' + end_date
+
+def timeline_choice(timeline: str):
+    """Returns the choice_group value that selects the given timeline"""
+    return timeline if timeline in TIMELINE_CHOICES else CUSTOM_TIMELINE
+
+def launch_date_index(df: pd.DataFrame):
+    """Returns the sorted launch dates and the number of them that are not NaT"""
+    launch = df['session_launch_date'].to_numpy()
+    n_valid = int(np.searchsorted(launch, np.datetime64('NaT'), side='left'))
+    return launch, n_valid
+
+def timeline_window(first: pd.Timestamp, latest: pd.Timestamp, x_filter: str):
+    """Resolves a timeline into launch date bounds, None meaning unbounded"""
+    first_day = first.normalize()
+    latest_day = latest.normalize()
+    latest_month_start = latest_day.replace(day=1)
+    latest_year_start = latest_day.replace(month=1, day=1)
+
+    if x_filter == 'First 30 days':
+        return None, first_day + pd.DateOffset(days=30)
+    if x_filter == 'Recent 30 days':
+        return latest_day - pd.DateOffset(days=30), None
+    if x_filter == 'Recent 60 days':
+        return latest_day - pd.DateOffset(days=60), None
+    if x_filter == 'Recent month':
+        return latest_month_start, None
+    if x_filter == 'Prev month':
+        return latest_month_start - pd.DateOffset(months=1), latest_month_start
+    if x_filter == 'Recent year':
+        return latest_year_start, None
+    if x_filter == 'Prev year':
+        return latest_year_start - pd.DateOffset(years=1), latest_year_start
+
+    # Custom range, both days included
+    if ' to ' in x_filter:
+        start_date, end_date = x_filter.split(' to ')
+        return pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.DateOffset(days=1)
+
+    return None, None
+
+def resolve_timeline_rows(x_filter: str, n_rows: int, n_valid: int, first: pd.Timestamp, latest: pd.Timestamp,
+                          position):
+    """Returns the [lo, hi) row positions of a timeline, position(ts) counting the sessions launched before ts"""
+    if x_filter == 'All':
+        return 0, n_rows
+    if n_valid == 0:
+        return 0, 0
+
+    start, end = timeline_window(first, latest, x_filter)
+    lo = 0 if start is None else position(start)
+    hi = n_valid if end is None else position(end)
+    return lo, max(lo, hi)
+
+def timeline_rows(df: pd.DataFrame, x_filter: str):
+    """Returns the [lo, hi) positions of the launch-date sorted sessions that fall in the timeline"""
+    launch, n_valid = launch_date_index(df)
+    first = pd.Timestamp(launch[0]) if n_valid else None
+    latest = pd.Timestamp(launch[n_valid - 1]) if n_valid else None
+
+    def position(ts: pd.Timestamp):
+        return int(np.searchsorted(launch[:n_valid], ts.to_datetime64(), side='left'))
+
+    return resolve_timeline_rows(x_filter, len(df), n_valid, first, latest, position)
+
+def dataset_timeline_rows(entry: dict, x_filter: str):
+    """Returns the [lo, hi) row positions of a timeline in a session store entry"""
+    if entry['sessions'] is not None:
+        return timeline_rows(entry['sessions'], x_filter)
+
+    meta = entry['meta']
+    return resolve_timeline_rows(x_filter, meta['n_rows'], meta['n_valid'], meta['first'], meta['latest'],
+                                 dataset_launch_position(entry))
+
+def dataset_launch_position(entry: dict):
+    """Returns position(ts), the number of sessions of a store entry launched before ts"""
+    if entry['sessions'] is not None:
+        launch, n_valid = launch_date_index(entry['sessions'])
+        return lambda ts: int(np.searchsorted(launch[:n_valid], ts.to_datetime64(), side='left'))
+
+    # Streamed reports look the bounds up in the analytics store's launch date index
+    meta = entry['meta']
+    return lambda ts: store_launch_position(entry['db_path'], ts, meta['n_valid'])
+
+def filter_rows_by_timeline(df: pd.DataFrame, x_filter: str):
+    """Returns the slice of launch-date sorted sessions that falls in the timeline"""
+    if x_filter == 'All':
+        return df
+
+    lo, hi = timeline_rows(df, x_filter)
+    return df.iloc[lo:hi]
 
+
+#
+# Batch mode: `python steam_stats.py REPORT_DIR -o OUT_DIR` runs the same
+# pipeline headless over every report in a directory, one report per
+# process, and writes the peak usage by day and the summary of each report
+# (install) and of all of them combined. Wave is not involved. Batch only
+# needs the daily rollup, so no analytics store is written: large reports
+# are streamed into usage totals, next to launches counted per day, which
+# is all a timeline's row range takes since timelines start on whole days.
+#
+BATCH_OUTPUT_FORMATS = ['csv', 'parquet']
+BATCH_REPORT_PATTERNS = ['*.' + x for x in REPORT_EXTENSIONS]
+PARQUET_ENGINES = ['pyarrow', 'fastparquet']
+
+def stream_usage_totals(file_path: str):
+    """Folds a report into usage totals chunk by chunk, returning them with its meta and launches per day"""
+    totals = new_usage_totals()
+    launch_days = pd.Series(dtype='float64')
+    columns = None
+    with diagnostics_stage('stream csv to totals') as stage, open_report(file_path) as (_, stream):
+        for chunk in pd.read_csv(stream, chunksize=INGEST_CHUNK_ROWS, dtype=SESSION_CSV_DTYPES):
+            chunk = fix_session_dtypes(chunk)
+            columns = chunk.columns.tolist()
+            update_usage_totals(totals, chunk)
+            launch_days = launch_days.add(chunk['session_launch_date'].dt.normalize().value_counts(), fill_value=0)
+        stage['rows_in'] = totals['n_rows']
+
+    # Timelines only read the first and latest launch days
+    launch_days = launch_days.sort_index()
+    meta = {
+        'columns': columns or [],
+        'n_rows': totals['n_rows'],
+        'n_valid': int(launch_days.sum()),
+        'first': launch_days.index[0] if len(launch_days) else None,
+        'latest': launch_days.index[-1] if len(launch_days) else None,
+    }
+    return totals, meta, launch_days
+
+def batch_usage_results(file_path: str, timeline: str):
+    """Rolls a report up and slices it down to a timeline, without an analytics store or the session store"""
+    if report_size(file_path) > STREAMING_INGEST_BYTES:
+        totals, meta, launch_days = stream_usage_totals(file_path)
+        rollup = build_daily_rollup(totals)
+        days, counts = launch_days.index.to_numpy(), np.cumsum(launch_days.to_numpy())
+
+        def position(ts: pd.Timestamp):
+            before = np.searchsorted(days, ts.to_datetime64(), side='left')
+            return int(counts[before - 1]) if before else 0
+
+        lo, hi = resolve_timeline_rows(timeline, meta['n_rows'], meta['n_valid'], meta['first'], meta['latest'],
+                                       position)
+    else:
+        sessions = read_sessions_csv(file_path)
+        rollup = build_daily_rollup(update_usage_totals(new_usage_totals(), sessions))
+        meta = sessions_meta(sessions)
+        lo, hi = timeline_rows(sessions, timeline)
+
+    a, b = rollup_window(rollup, meta, timeline)
+    return {
+        'file_path': file_path,
+        'timeline': timeline,
+        'summary': rollup_summary(rollup, a, b, hi - lo),
+        'peak_usage': rollup_peak_usage(rollup, a, b),
+    }
+
+def batch_report(file_path: str, timeline: str):
+    """Returns the peak usage by day and the summary KPIs of one report over a timeline"""
+    results = batch_usage_results(file_path, timeline)
+    summary = summary_kpis(results)
+    summary['Values'] = summary['Values'].astype(str)
+    return results['peak_usage'], summary
+
+def write_table(df: pd.DataFrame, path: str, fmt: str):
+    """Writes a table as csv or parquet, path given without extension"""
+    if fmt == 'parquet':
+        df.to_parquet(path + '.parquet', index=False)
+    else:
+        df.to_csv(path + '.csv', index=False)
+
+def run_batch(report_dir: str, out_dir: str, timeline: str = 'All', fmt: str = 'csv', jobs: int = None,
+              pattern: str = None):
+    """Processes every report in a directory on a process pool, returning the reports that failed"""
+    patterns = BATCH_REPORT_PATTERNS if pattern is None else [pattern]
+    reports = sorted({x for p in patterns for x in glob.glob(os.path.join(report_dir, p))})
+    os.makedirs(out_dir, exist_ok=True)
+
+    peaks, summaries, failed = [], [], []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(batch_report, path, timeline): path for path in reports}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            install = os.path.splitext(report_csv_name(path))[0]
+            try:
+                peak_usage, summary = future.result()
+            except Exception as e:
+                print('{0}: failed, {1}'.format(path, e), file=sys.stderr)
+                failed.append(path)
+                continue
+
+            os.makedirs(os.path.join(out_dir, install), exist_ok=True)
+            write_table(peak_usage, os.path.join(out_dir, install, 'peak_usage'), fmt)
+            write_table(summary, os.path.join(out_dir, install, 'summary'), fmt)
+            peaks.append(peak_usage.assign(Install=install))
+            summaries.append(summary.set_index('KPI')['Values'].rename(install))
+            print('{0}: {1} days'.format(path, len(peak_usage)))
+
+    # One row per install and day, and one row of KPIs per install
+    if peaks:
+        peak_usage = pd.concat(peaks, ignore_index=True)
+        write_table(peak_usage[['Install'] + PEAK_USAGE_COLUMNS].sort_values(['Install', 'Day Present']),
+                    os.path.join(out_dir, 'peak_usage'), fmt)
+        summary = pd.DataFrame(summaries).rename_axis('Install').reset_index().sort_values('Install')
+        write_table(summary, os.path.join(out_dir, 'summary'), fmt)
+    return failed
+
+def batch_main(argv: list = None):
+    parser = argparse.ArgumentParser(description='Writes the peak usage by day and summary of steam reports')
+    parser.add_argument('report_dir', help='directory of driverless-report csv files')
+    parser.add_argument('-o', '--out', default='./steam-stats-out', help='output directory')
+    parser.add_argument('-t', '--timeline', default='All',
+                        help='one of {0}, or "YYYY-MM-DD to YYYY-MM-DD"'.format(', '.join(TIMELINE_CHOICES)))
+    parser.add_argument('-f', '--format', default='csv', choices=BATCH_OUTPUT_FORMATS)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, all cores by default')
+    parser.add_argument('-p', '--pattern', default=None,
+                        help='file name pattern of the reports, any {0} file by default'.format(
+                            ', '.join(REPORT_EXTENSIONS)))
+    args = parser.parse_args(argv)
+    if args.timeline not in TIMELINE_CHOICES and ' to ' not in args.timeline:
+        parser.error('unknown timeline {0}'.format(args.timeline))
+    # Checked before any report is processed, rather than when writing the first output
+    if args.format == 'parquet' and not any(importlib.util.find_spec(x) for x in PARQUET_ENGINES):
+        parser.error('parquet output needs one of {0}'.format(', '.join(PARQUET_ENGINES)))
+
+    failed = run_batch(args.report_dir, args.out, args.timeline, args.format, args.jobs, args.pattern)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    batch_main()
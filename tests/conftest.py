@@ -0,0 +1,57 @@
+#
+# Shared fixtures: synthetic driverless-reports and an analytics store
+# of their own for every test, so tests never touch ./data.
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+import steam_stats
+
+
+def write_report(path, n=400, seed=0, start='2021-01-01'):
+    """Writes a driverless-report csv with long, running, failed and overnight sessions"""
+    rng = np.random.default_rng(seed)
+    launch = pd.Timestamp(start).value // 10**9 + rng.integers(0, 400 * 86400, n)
+    duration = rng.exponential(8 * 3600, n).astype(int)
+    long_sessions = rng.random(n) < 0.05
+    duration[long_sessions] = rng.integers(86400, 12 * 86400, long_sessions.sum())
+    state = rng.choice(['finished', 'finished', 'finished', 'running', 'failed'], n)
+    cpus = rng.choice([2, 4, 8, 16], n).astype(float)
+    cpus[rng.random(n) < 0.05] = np.nan
+    pd.DataFrame({
+        'id': np.arange(n),
+        'username': ['user%d' % x for x in rng.integers(0, 25, n)],
+        'version': ['1.%d.0' % x for x in rng.integers(0, 6, n)],
+        'session_state': state,
+        'session_launch_date': pd.to_datetime(launch, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        'session_launch_unix': launch,
+        'session_end_unix': np.where(state == 'running', np.nan, launch + duration),
+        'session_duration_sec': duration,
+        'cpu_count': cpus,
+        'gpu_count': rng.choice([0, 0, 1, 2], n),
+    }).sample(frac=1, random_state=seed).to_csv(path, index=False)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Points the app at an empty analytics store, with empty session store and result cache"""
+    path = tmp_path / 'store'
+    path.mkdir()
+    monkeypatch.setattr(steam_stats, 'ANALYTICS_STORE_PATH', str(path))
+    for file_path in list(steam_stats.session_store):
+        steam_stats.forget_dataset(file_path)
+    steam_stats.clear_result_cache()
+    yield path
+    for file_path in list(steam_stats.session_store):
+        steam_stats.forget_dataset(file_path)
+    steam_stats.clear_result_cache()
+
+
+@pytest.fixture(params=['memory', 'streamed'])
+def ingest(request, monkeypatch):
+    """Ingests reports in memory, or streams them into the analytics store in small chunks"""
+    if request.param == 'streamed':
+        monkeypatch.setattr(steam_stats, 'STREAMING_INGEST_BYTES', 0)
+        monkeypatch.setattr(steam_stats, 'INGEST_CHUNK_ROWS', 97)
+    return request.param
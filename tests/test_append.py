@@ -0,0 +1,155 @@
+#
+# Incremental append: the merged report's rollup, spliced from the old one
+# and the days the appended export touches, must slice to the same results
+# as a full rebuild of the merged file, over every timeline.
+#
+import asyncio
+import gzip
+import os
+import shutil
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from h2o_wave.core import Expando
+
+import steam_stats
+from conftest import write_report
+
+TIMELINES = steam_stats.TIMELINE_CHOICES + ['2021-03-01 to 2021-05-01', '2021-12-01 to 2022-02-15']
+
+
+def write_exports(tmp_path, name='driverless-report.csv'):
+    """Writes an old export and a re-export of the same name, overlapping it and with sessions that have finished since"""
+    full_path = tmp_path / 'full.csv'
+    write_report(full_path, n=600, seed=3)
+    sessions = pd.read_csv(full_path)
+    cut = sessions['session_launch_unix'].quantile(0.8)
+
+    old = sessions[sessions['session_launch_unix'] < cut].copy()
+    near = old['session_launch_unix'] > cut - 5 * 86400
+    old.loc[near, 'session_state'] = 'running'
+    old.loc[near, 'session_end_unix'] = np.nan
+    old.loc[near, 'session_duration_sec'] = (cut - old.loc[near, 'session_launch_unix']).astype(int)
+    new = sessions[sessions['session_launch_unix'] >= cut - 10 * 86400].sample(frac=1, random_state=1)
+
+    (tmp_path / 'week1').mkdir()
+    (tmp_path / 'week2').mkdir()
+    old.to_csv(tmp_path / 'week1' / name, index=False)
+    new.to_csv(tmp_path / 'week2' / name, index=False)
+    return str(tmp_path / 'week1' / name), str(tmp_path / 'week2' / name), len(sessions)
+
+
+def assert_same_results(incremental, full, file_path):
+    for timeline in TIMELINES:
+        a = steam_stats.slice_usage_results(file_path, incremental, timeline)
+        b = steam_stats.slice_usage_results(file_path, full, timeline)
+        assert a['summary'] == b['summary'], timeline
+        pd.testing.assert_frame_equal(a['peak_usage'], b['peak_usage'], obj=timeline)
+        pd.testing.assert_frame_equal(a['concurrency'], b['concurrency'], obj=timeline)
+
+        rolling = [steam_stats.rollup_rolling_usage(x['rollup'], *steam_stats.rollup_window(x['rollup'], x['meta'],
+                                                                                          timeline))
+                   for x in [incremental, full]]
+        pd.testing.assert_frame_equal(rolling[0], rolling[1], obj=timeline)
+
+
+def test_append_matches_full_rebuild(tmp_path, store, ingest, monkeypatch):
+    old_path, new_path, n_sessions = write_exports(tmp_path)
+    merged_path = steam_stats.append_report(old_path, new_path)
+    assert len(pd.read_csv(merged_path)) == n_sessions
+    incremental = steam_stats.stored_dataset(merged_path)
+
+    # Full rebuild of the merged file, in an analytics store of its own
+    steam_stats.forget_dataset(merged_path)
+    rebuilt = tmp_path / 'rebuilt'
+    rebuilt.mkdir()
+    monkeypatch.setattr(steam_stats, 'ANALYTICS_STORE_PATH', str(rebuilt))
+    full = steam_stats.open_dataset(merged_path)
+    assert full is not incremental
+
+    assert_same_results(incremental, full, merged_path)
+
+
+class FakePage(dict):
+    """Page whose missing cards read as None, like an empty Wave page"""
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __delitem__(self, key):
+        self.pop(key, None)
+
+    async def save(self):
+        pass
+
+
+class FakeSite:
+    """Site whose downloads copy a local file into the given directory"""
+    async def download(self, url, path):
+        return shutil.copy(url, path)
+
+
+async def upload(q, file_path, append=False):
+    q.args = Expando({'file_upload': [file_path], 'append_upload': append})
+    await steam_stats.serve(q)
+
+
+def test_append_upload_of_same_name_export_keeps_history(tmp_path, store, monkeypatch):
+    # Both exports are named driverless-report.csv, as a weekly re-export is
+    old_path, new_path, n_sessions = write_exports(tmp_path)
+    monkeypatch.chdir(tmp_path)
+
+    async def no_sleep(delay):
+        pass
+
+    q = Expando()
+    q.page, q.site, q.client, q.app, q.events = FakePage(), FakeSite(), Expando(), Expando(), Expando()
+    q.exec = lambda executor, func, *args: asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    q.sleep = no_sleep
+
+    async def session():
+        q.args = Expando()
+        await steam_stats.serve(q)
+        await upload(q, old_path)
+        await upload(q, new_path, append=True)
+    asyncio.run(session())
+
+    assert q.client.analytics_error is None
+    assert len(pd.read_csv(q.client.working_file_path)) == n_sessions
+    assert len(pd.read_csv('data/driverless-report.csv')) == len(pd.read_csv(old_path))
+
+    # Appending the same export again changes nothing, and replaces the merge in place
+    merged_path = q.client.working_file_path
+    assert steam_stats.append_report(merged_path, new_path) == merged_path
+    assert len(pd.read_csv(merged_path)) == n_sessions
+
+
+def compress_report(path, ext):
+    """Replaces a csv report with its .csv.gz or .zip form, returning the new path"""
+    compressed = path + '.gz' if ext == '.csv.gz' else os.path.splitext(path)[0] + '.zip'
+    if ext == '.csv.gz':
+        with open(path, 'rb') as f, gzip.open(compressed, 'wb') as out:
+            shutil.copyfileobj(f, out)
+    else:
+        with zipfile.ZipFile(compressed, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.write(path, os.path.basename(path))
+    os.remove(path)
+    return compressed
+
+
+@pytest.mark.parametrize('ext', ['.csv.gz', '.zip'])
+def test_append_keeps_compression(tmp_path, store, ext):
+    old_path, new_path, n_sessions = write_exports(tmp_path)
+    new_path = compress_report(new_path, ext)
+
+    merged_path = steam_stats.append_report(old_path, new_path)
+    assert merged_path.endswith(ext)
+    assert steam_stats.report_compression(merged_path) == steam_stats.report_compression(new_path)
+    assert len(pd.read_csv(merged_path)) == n_sessions
+    assert steam_stats.open_dataset(merged_path)['meta']['n_rows'] == n_sessions
+
+    # The same sessions compress to the same bytes, so appending again keeps the store
+    db_path = steam_stats.open_dataset(merged_path)['db_path']
+    assert steam_stats.append_report(merged_path, new_path) == merged_path
+    assert steam_stats.open_dataset(merged_path)['db_path'] == db_path
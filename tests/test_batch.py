@@ -0,0 +1,49 @@
+#
+# Batch mode rolls reports up without an analytics store. Its peak usage
+# and summary must be those of the app over every timeline, for reports
+# held in memory and for streamed ones.
+#
+import gzip
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import steam_stats
+from conftest import write_report
+
+TIMELINES = steam_stats.TIMELINE_CHOICES + ['2021-03-01 to 2021-05-01']
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / 'reports' / 'driverless-report.csv'
+    path.parent.mkdir()
+    write_report(path, n=500, seed=5)
+    return str(path)
+
+
+def test_batch_matches_app(report, store, ingest):
+    for timeline in TIMELINES:
+        app = steam_stats.usage_results(report, timeline)
+        peak_usage, summary = steam_stats.batch_report(report, timeline)
+        pd.testing.assert_frame_equal(peak_usage, app['peak_usage'], obj=timeline)
+        expected = steam_stats.summary_kpis(app)
+        expected['Values'] = expected['Values'].astype(str)
+        pd.testing.assert_frame_equal(summary, expected, obj=timeline)
+
+
+def test_batch_writes_no_store(report, store, ingest):
+    steam_stats.batch_report(report, 'Recent 30 days')
+    assert os.listdir(store) == []
+
+
+def test_batch_picks_compressed_reports(report, tmp_path):
+    with open(report, 'rb') as f, gzip.open(report + '.gz', 'wb') as out:
+        shutil.copyfileobj(f, out)
+    os.rename(report, str(tmp_path / 'other.csv'))
+
+    assert steam_stats.run_batch(os.path.dirname(report), str(tmp_path / 'out'), jobs=1) == []
+    summary = pd.read_csv(tmp_path / 'out' / 'summary.csv')
+    assert summary['Install'].tolist() == ['driverless-report']
@@ -0,0 +1,83 @@
+#
+# Interval index: sessions active at a time, or at some time in a range,
+# found by the implicit centered interval tree must be exactly those a
+# brute force scan finds, with tied, zero-length, reversed and missing
+# intervals. The active sessions drill-down must agree in memory and
+# streamed.
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+import steam_stats
+from conftest import write_report
+
+
+def brute_stab(launch, end, t):
+    valid = ~np.isnan(launch) & ~np.isnan(end) & (end >= launch)
+    return np.flatnonzero(valid & (launch <= t) & (end >= t))
+
+
+def brute_overlaps(launch, end, t1, t2):
+    valid = ~np.isnan(launch) & ~np.isnan(end) & (end >= launch)
+    return np.flatnonzero(valid & (launch < t2) & (end >= t1))
+
+
+def random_intervals(n, seed):
+    """Intervals over a small range of integer times, so that launches, ends and queries tie often"""
+    rng = np.random.default_rng(seed)
+    launch = rng.integers(0, 1000, n).astype(float)
+    end = launch + rng.choice([0, 0, 1, 5, 50, 500], n) * rng.random(n).round(1)
+    launch[rng.random(n) < 0.05] = np.nan
+    end[rng.random(n) < 0.05] = np.nan
+    end[rng.random(n) < 0.03] -= 1000
+    return launch, end
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 3, 7, 8, 9, 100, 3000])
+def test_interval_index_matches_brute_force(n):
+    launch, end = random_intervals(n, seed=n)
+    index = steam_stats.build_interval_index(launch, end)
+
+    times = np.r_[np.arange(-10, 1100, 7), launch[~np.isnan(launch)][:50], end[~np.isnan(end)][:50]]
+    for t in times:
+        np.testing.assert_array_equal(np.sort(steam_stats.interval_stab(index, t)), brute_stab(launch, end, t))
+        for width in [0.5, 1, 10, 300]:
+            np.testing.assert_array_equal(steam_stats.interval_overlaps(index, t, t + width),
+                                          brute_overlaps(launch, end, t, t + width))
+
+
+def test_interval_index_of_identical_and_zero_length_intervals():
+    launch = np.array([5.0, 5.0, 5.0, 5.0, 2.0, 8.0])
+    end = np.array([5.0, 5.0, 9.0, 9.0, 2.0, 8.0])
+    index = steam_stats.build_interval_index(launch, end)
+    assert sorted(steam_stats.interval_stab(index, 5.0)) == [0, 1, 2, 3]
+    assert sorted(steam_stats.interval_stab(index, 8.0)) == [2, 3, 5]
+    assert steam_stats.interval_overlaps(index, 2.0, 5.0).tolist() == [4]
+    assert steam_stats.interval_overlaps(index, 5.5, 6.0).tolist() == [2, 3]
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / 'driverless-report.csv'
+    write_report(path, n=3000, seed=7)
+    return str(path)
+
+
+def test_active_sessions_match_brute_force(report, store, ingest):
+    sessions = pd.read_csv(report)
+    finished = sessions[sessions['session_state'] == 'finished']
+    launch = finished['session_launch_unix'].to_numpy(dtype='float64')
+    end = finished['session_end_unix'].to_numpy(dtype='float64')
+
+    for day in pd.date_range('2020-12-30', '2022-02-20', freq='9D').strftime('%Y-%m-%d'):
+        for hour in [None, 0, 13, 23]:
+            t1 = pd.Timestamp(day).value / 10**9 + 3600 * (hour or 0)
+            t2 = t1 + (86400 if hour is None else 3600)
+            expected = finished.iloc[brute_overlaps(launch, end, t1, t2)]
+
+            rows, n_rows, users = steam_stats.active_sessions(report, day, hour)
+            assert n_rows == len(expected) <= steam_stats.ACTIVE_SESSION_MAX_ROWS
+            assert sorted(rows['id'].tolist()) == sorted(expected['id'].tolist())
+            assert users['Sessions'].sum() == n_rows
+            assert users['CPUs'].sum() == expected['cpu_count'].fillna(0).sum()
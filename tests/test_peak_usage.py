@@ -0,0 +1,85 @@
+#
+# Peak usage parity: the Peak Usage by Day table the app slices from its
+# daily rollup must be the one the pandasql range join it replaced gave,
+# for the timelines where both count the same sessions: All, and First 30
+# days, which no session launched before. Other timelines count sessions
+# running into them (see test_rollup_window.py). pandasql is only needed
+# by this test.
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+import steam_stats
+from conftest import write_report
+
+psql = pytest.importorskip('pandasql')
+
+PEAK_COLUMNS = ['Day Present', 'Peak Sessions', 'Peak CPUs', 'Peak GPUs', 'Unique Users']
+
+
+def sql_peak_usage(sessions):
+    """Peak Usage by Day as the app computed it before, with a pandasql range join"""
+    min_max_ts = psql.sqldf("""
+                    select min(datetime(session_launch_unix,'unixepoch')) as min_ts,
+                               max(datetime(session_end_unix,'unixepoch')) as max_ts
+                    from sessions
+                    where session_state='finished'
+            """, locals())
+    v_basetable = psql.sqldf("""
+                    select *, datetime(session_launch_unix,'unixepoch') as start_ts,
+                                      datetime(session_end_unix,'unixepoch') as end_ts
+                    from sessions
+                    where session_state='finished'
+            """, locals())
+    min_max = psql.sqldf("""
+                    select date(min_ts) as minval,
+                               date(max_ts) as maxval
+                            from min_max_ts
+            """, locals())
+
+    rx = pd.date_range(start=min_max['minval'].values[0], end=min_max['maxval'].values[0], freq='D')
+    range_values = pd.DataFrame(rx)
+    range_values.columns = ['day_present']
+
+    base_table_expanded = psql.sqldf("""
+                    select *
+                            from
+                            (select * from v_basetable) a
+                                    inner join range_values b
+                            on
+                                    (date(a.start_ts) <= date(b.day_present)
+                                    and
+                                     date(a.end_ts) >= date(b.day_present))
+            """, locals())
+    return psql.sqldf("""
+                    select date(a.day_present) as 'Day Present',
+                            sum(case when b.start_ts is null then 0 else 1 end) as 'Peak Sessions',
+                            sum(case when b.cpu_count is null then 0 else b.cpu_count end) as 'Peak CPUs',
+                            sum(case when b.gpu_count is null then 0 else b.gpu_count end) as 'Peak GPUs',
+                            count(distinct username) as 'Unique Users'
+                    from
+                            range_values a
+                                    left join
+                            base_table_expanded b
+                                    on (date(a.day_present) = date(b.day_present))
+                    group by 1
+                    order by 1
+            """, locals())
+
+
+@pytest.fixture(scope='module')
+def report(tmp_path_factory):
+    path = tmp_path_factory.mktemp('reports') / 'driverless-report.csv'
+    write_report(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('timeline', ['All', 'First 30 days'])
+def test_peak_usage_matches_sql(report, store, ingest, timeline):
+    sessions = steam_stats.filter_rows_by_timeline(steam_stats.read_sessions_csv(report), timeline)
+    raw = pd.read_csv(report)
+    expected = sql_peak_usage(raw[raw['id'].isin(sessions['id'])])
+
+    peak_usage = steam_stats.usage_results(report, timeline)['peak_usage'][PEAK_COLUMNS]
+    pd.testing.assert_frame_equal(peak_usage.reset_index(drop=True), expected, check_dtype=False)
@@ -0,0 +1,70 @@
+#
+# Timeline windows: over a timeline other than All, the peak usage and the
+# summary count the activity on the window's days, clipped to them, with
+# sessions that ran into the window from before or out of it after. Only
+# Total Sessions counts the sessions launched in the window.
+#
+import pandas as pd
+import pytest
+
+import steam_stats
+
+WINDOW = '2021-03-10 to 2021-03-12'
+
+# (user, cpus, launch, end): a runs into the window, b is inside it, c runs
+# out of it, d and e are outside it
+SESSIONS = [
+    ('a', 4, '2021-03-08 12:00:00', '2021-03-11 12:00:00'),
+    ('b', 2, '2021-03-11 06:00:00', '2021-03-11 08:00:00'),
+    ('c', 8, '2021-03-12 20:00:00', '2021-03-14 00:00:00'),
+    ('d', 1, '2021-03-20 00:00:00', '2021-03-20 05:00:00'),
+    ('e', 1, '2021-03-01 00:00:00', '2021-03-01 01:00:00'),
+]
+
+
+@pytest.fixture
+def report(tmp_path):
+    launch = pd.to_datetime([x[2] for x in SESSIONS])
+    end = pd.to_datetime([x[3] for x in SESSIONS])
+    path = tmp_path / 'driverless-report.csv'
+    pd.DataFrame({
+        'id': range(len(SESSIONS)),
+        'username': [x[0] for x in SESSIONS],
+        'version': '1.0.0',
+        'session_state': 'finished',
+        'session_launch_date': launch.strftime('%Y-%m-%d %H:%M:%S'),
+        'session_launch_unix': launch.astype('int64') // 10**9,
+        'session_end_unix': end.astype('int64') // 10**9,
+        'session_duration_sec': (end - launch).total_seconds().astype(int),
+        'cpu_count': [x[1] for x in SESSIONS],
+        'gpu_count': 0,
+    }).to_csv(path, index=False)
+    return str(path)
+
+
+def test_peak_usage_counts_sessions_running_into_the_window(report, store, ingest):
+    peak_usage = steam_stats.usage_results(report, WINDOW)['peak_usage']
+    assert peak_usage['Day Present'].tolist() == ['2021-03-10', '2021-03-11', '2021-03-12']
+    assert peak_usage['Peak Sessions'].tolist() == [1, 2, 1]
+    assert peak_usage['Peak CPUs'].tolist() == [4, 6, 8]
+    assert peak_usage['Unique Users'].tolist() == [1, 2, 1]
+
+
+def test_summary_counts_activity_on_the_window_days(report, store, ingest):
+    summary = steam_stats.usage_results(report, WINDOW)['summary']
+    assert summary['n_rows'] == 2
+    assert summary['hours'] == 36 + 2 + 4
+    assert summary['unique_users'] == 3
+    assert summary['min_ts'] == pd.Timestamp('2021-03-11 06:00:00').strftime('%c')
+    assert summary['max_ts'] == pd.Timestamp('2021-03-11 12:00:00').strftime('%c')
+
+
+def test_summary_labels_name_their_definition(report, store):
+    kpis = steam_stats.summary_kpis(steam_stats.usage_results(report, WINDOW)).set_index('KPI')['Values']
+    assert kpis['Total Sessions (launched in range)'] == 2
+    assert kpis['# of Unique Users (active in range)'] == 3
+    assert kpis['Total Hours of Use (use within range)'] == 42
+
+    kpis = steam_stats.summary_kpis(steam_stats.usage_results(report, 'All')).set_index('KPI')['Values']
+    assert kpis['Total Sessions'] == len(SESSIONS)
+    assert kpis['# of Unique Users'] == len(SESSIONS)
@@ -0,0 +1,95 @@
+#
+# Distinct sketches: an exact bitmap must count the users and versions of
+# any range of days exactly as a scan of the rollup's per-day ids does,
+# and a HyperLogLog must stay within a few standard errors of it, small
+# ranges included (linear counting).
+#
+import numpy as np
+import pytest
+
+import steam_stats
+from conftest import write_report
+
+
+def brute_distinct(name_ids, a, b):
+    ptr, ids, names = name_ids
+    return len(np.unique(ids[ptr[a]:ptr[b]]))
+
+
+def random_name_ids(n_names, n_days, per_day, seed):
+    """Per-day (ptr, ids, names) of names seen on each day, with days of no names"""
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(0, per_day, n_days)
+    counts[rng.random(n_days) < 0.2] = 0
+    ids = np.concatenate([rng.choice(n_names, min(x, n_names), replace=False) for x in counts])
+    ptr = np.r_[0, np.cumsum([min(x, n_names) for x in counts])]
+    return ptr, ids.astype(np.int32), np.array(['user%d' % x for x in range(n_names)], dtype=object)
+
+
+@pytest.mark.parametrize('n_names', [1, 7, 8, 9, 1003])
+def test_exact_sketch_matches_brute_force(monkeypatch, n_names):
+    monkeypatch.setattr(steam_stats, 'DISTINCT_SKETCH', 'exact')
+    n_days = 30
+    name_ids = random_name_ids(n_names, n_days, per_day=40, seed=n_names)
+    sketch = steam_stats.distinct_sketch(name_ids, n_days)
+    assert sketch['kind'] == 'exact'
+
+    for a in range(n_days + 1):
+        for b in range(a, n_days + 1):
+            assert steam_stats.sketch_distinct(sketch, a, b) == (brute_distinct(name_ids, a, b), 0.0)
+
+
+def test_rollup_sketches_match_brute_force(tmp_path, store, ingest):
+    report = str(tmp_path / 'driverless-report.csv')
+    write_report(report, n=1500, seed=5)
+    rollup = steam_stats.open_dataset(report)['rollup']
+
+    n_days = rollup['n_days']
+    for key in ['users', 'versions']:
+        sketch = rollup['sketches'][key]
+        assert sketch['kind'] == 'exact'
+        for a in range(0, n_days + 1, 3):
+            for b in range(a, n_days + 1, 5):
+                assert steam_stats.sketch_distinct(sketch, a, b) == (brute_distinct(rollup[key], a, b), 0.0)
+
+
+def test_sketch_kind(monkeypatch):
+    few = random_name_ids(8 * steam_stats.HLL_REGISTERS, 2, per_day=10, seed=0)
+    many = random_name_ids(8 * steam_stats.HLL_REGISTERS + 1, 2, per_day=10, seed=0)
+    assert steam_stats.distinct_sketch(few, 2)['kind'] == 'exact'
+    assert steam_stats.distinct_sketch(many, 2)['kind'] == 'hll'
+
+    monkeypatch.setattr(steam_stats, 'DISTINCT_SKETCH', 'exact')
+    assert steam_stats.distinct_sketch(many, 2)['kind'] == 'exact'
+    monkeypatch.setattr(steam_stats, 'DISTINCT_SKETCH', 'hll')
+    assert steam_stats.distinct_sketch(few, 2)['kind'] == 'hll'
+
+
+def test_hll_sketch_within_standard_error(monkeypatch):
+    monkeypatch.setattr(steam_stats, 'DISTINCT_SKETCH', 'hll')
+    n_days = 60
+    name_ids = random_name_ids(300000, n_days, per_day=12000, seed=1)
+    sketch = steam_stats.distinct_sketch(name_ids, n_days)
+    assert sketch['kind'] == 'hll'
+
+    error = 1.04 / np.sqrt(steam_stats.HLL_REGISTERS)
+    ranges = [(0, n_days), (0, 1), (10, 11), (20, 25), (5, 40), (30, 60)] + [(a, a + 1) for a in range(40, 60)]
+    for a, b in ranges:
+        expected = brute_distinct(name_ids, a, b)
+        count, count_error = steam_stats.sketch_distinct(sketch, a, b)
+        assert count_error == error
+        assert abs(count - expected) <= 4 * error * max(expected, 1), (a, b, count, expected)
+
+    assert steam_stats.sketch_distinct(sketch, 7, 7) == (0, 0.0)
+
+
+@pytest.mark.parametrize('n_names', [1, 2, 10, 100, 1000])
+def test_hll_sketch_of_few_names(monkeypatch, n_names):
+    monkeypatch.setattr(steam_stats, 'DISTINCT_SKETCH', 'hll')
+    ptr = np.array([0, 0, n_names])
+    name_ids = ptr, np.arange(n_names, dtype=np.int32), np.array(['v%d' % x for x in range(n_names)], dtype=object)
+    sketch = steam_stats.distinct_sketch(name_ids, 2)
+
+    assert steam_stats.sketch_distinct(sketch, 0, 1)[0] == 0
+    count = steam_stats.sketch_distinct(sketch, 0, 2)[0]
+    assert abs(count - n_names) <= max(1, 0.05 * n_names)
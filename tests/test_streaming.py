@@ -0,0 +1,88 @@
+#
+# Streamed ingest parity: a report streamed into the analytics store in
+# small chunks must give the app the same results as the same report
+# parsed in memory, for every timeline: the summary, peak usage by day,
+# concurrency, rolling usage, group by and raw table pages.
+#
+import numpy as np
+import pandas as pd
+import pytest
+
+import steam_stats
+from conftest import write_report
+
+TIMELINES = steam_stats.TIMELINE_CHOICES + [steam_stats.custom_timeline('2021-04-03', '2021-09-17')]
+
+GROUP_BYS = [
+    {'keys': ['username'], 'metrics': ['sessions', 'hours']},
+    {'keys': ['version', 'session_state'], 'metrics': list(steam_stats.GROUP_BY_METRICS)},
+    {'keys': ['week'], 'metrics': ['cpu_hours', 'gpu_hours']},
+]
+
+VIEWS = [
+    {},
+    {'offset': 2 * steam_stats.RAW_TABLE_ROWS_PER_PAGE},
+    {'sort': {'username': False}},
+    {'sort': {'session_duration_sec': True}, 'offset': steam_stats.RAW_TABLE_ROWS_PER_PAGE},
+    {'search': {'value': 'user1', 'cols': ['username']}},
+    {'filters': {'session_state': ['running', 'failed'], 'version': ['1.2.0']}, 'sort': {'id': False}},
+]
+
+
+def app_results(report, timeline):
+    """Everything the app shows of a report over a timeline"""
+    results = steam_stats.usage_results(report, timeline)
+    return {
+        'summary': results['summary'],
+        'peak_usage': results['peak_usage'],
+        'concurrency': results['concurrency'],
+        'rolling_usage': steam_stats.rolling_usage(report, timeline),
+        # Group rows are named in the order chunks first meet them
+        'group_by': [(top.reset_index(drop=True), n_groups)
+                     for top, n_groups in (steam_stats.group_sessions(report, timeline, x) for x in GROUP_BYS)],
+        'raw_table': [steam_stats.raw_table_page(report, timeline, dict(steam_stats.new_raw_table_view(), **x))
+                      for x in VIEWS],
+    }
+
+
+def assert_same(streamed, in_memory, where):
+    if isinstance(in_memory, pd.DataFrame):
+        pd.testing.assert_frame_equal(streamed, in_memory, check_dtype=False, check_categorical=False,
+                                      check_index_type=False, obj=where)
+    elif isinstance(in_memory, pd.Series):
+        pd.testing.assert_series_equal(streamed, in_memory, check_dtype=False, check_categorical=False,
+                                       check_index_type=False, obj=where)
+    elif isinstance(in_memory, dict):
+        assert streamed.keys() == in_memory.keys(), where
+        for key in in_memory:
+            assert_same(streamed[key], in_memory[key], '{0}[{1!r}]'.format(where, key))
+    elif isinstance(in_memory, (list, tuple)):
+        assert len(streamed) == len(in_memory), where
+        for i, (x, y) in enumerate(zip(streamed, in_memory)):
+            assert_same(x, y, '{0}[{1}]'.format(where, i))
+    elif isinstance(in_memory, float) and np.isnan(in_memory):
+        assert np.isnan(streamed), where
+    else:
+        assert streamed == in_memory, where
+
+
+@pytest.fixture
+def report(tmp_path):
+    path = tmp_path / 'driverless-report.csv'
+    write_report(path, n=1500, seed=3)
+    return str(path)
+
+
+def test_streamed_results_match_in_memory(report, store, monkeypatch):
+    # Group by sums chunks of this size either way, in the same order
+    monkeypatch.setattr(steam_stats, 'INGEST_CHUNK_ROWS', 97)
+    in_memory = {x: app_results(report, x) for x in TIMELINES}
+    assert steam_stats.open_dataset(report)['sessions'] is not None
+
+    steam_stats.forget_dataset(report)
+    steam_stats.clear_result_cache()
+    monkeypatch.setattr(steam_stats, 'STREAMING_INGEST_BYTES', 0)
+
+    streamed = {x: app_results(report, x) for x in TIMELINES}
+    assert steam_stats.open_dataset(report)['sessions'] is None
+    assert_same(streamed, in_memory, 'streamed')